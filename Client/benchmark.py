@@ -0,0 +1,122 @@
+"""
+Startup benchmark of the agent, run from this directory::
+
+    python benchmark.py --services 20 --runs 5
+
+Each run starts a fresh agent process against a local stub server, loads a config of file and pid checks and
+runs the first check cycle (registering every service), then reports the time and resident memory used.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+CLIENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# eager: what the agent imported before check dependencies were imported lazily (requests and procscan)
+_CHILD = '''
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {client_dir!r})
+if {eager!r}:
+    import requests
+    import procscan
+from config import Config
+from service import Services
+Services(Config({config!r}))
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+print(json.dumps({{'ready': time.perf_counter() - start, 'rss': rss, 'modules': len(sys.modules),
+                  'requests': 'requests' in sys.modules}}))
+'''
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # answers every request like a server accepting the registration, keeping connections alive
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, without this every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'Service registered'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def write_config(path: str, url: str, services: int, transport: str) -> None:
+    config = {
+        'general': {
+            'server': {'url': url, 'transport': transport},
+            'local': {'sleep_interval': 10, 'require_root': False},
+        },
+        'auth': {'access_token': 'benchmark'},
+        'services': [
+            {
+                'name': f'service_{i}',
+                'type': 'http',
+                'description': f'benchmark service {i}',
+                'data': {},
+                'valid_period': 60,
+                'method': {'name': 'file', 'param': [path]} if i % 2 else {'name': 'pid', 'param': [os.getpid()]},
+            }
+            for i in range(services)
+        ],
+    }
+    with open(path, 'w') as f:
+        json.dump(config, f)
+
+
+def run_agent(config: str, eager: bool) -> dict:
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', _CHILD.format(client_dir=CLIENT_DIR, eager=eager, config=config)],
+                         check=True, capture_output=True, text=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result['total'] = time.perf_counter() - start
+    return result
+
+
+def bench_startup(services: int, runs: int) -> None:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    variants = [
+        ('eager (previous)', True, 'requests'),
+        ('lazy, requests', False, 'requests'),
+        ('lazy, http.client', False, 'http.client'),
+    ]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for label, eager, transport in variants:
+                config = os.path.join(tmp, f'{transport}.json')
+                write_config(config, url, services, transport)
+                results: List[dict] = [run_agent(config, eager) for _ in range(runs)]
+                best = min(results, key=lambda r: r['total'])
+                print(f'{label:<20} process {best["total"] * 1000:7.1f} ms  ready {best["ready"] * 1000:7.1f} ms  '
+                      f'RSS {best["rss"] / 1024:6.1f} MiB  {best["modules"]:4} modules  '
+                      f'requests {"loaded" if best["requests"] else "not loaded"}')
+    finally:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Agent startup benchmark')
+    parser.add_argument('--services', type=int, default=20, help='services in the config, file and pid checks')
+    parser.add_argument('--runs', type=int, default=5, help='runs per variant, the fastest is reported')
+    args = parser.parse_args()
+    bench_startup(args.services, args.runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import json
+import time
+from typing import Any, Dict, Tuple
+
+from data import METHODS
+
+
+class CheckCache:
+    """
+    Results of check methods keyed by (method, params), so that services sharing a target are checked once
+
+    A result is reused within the cycle it was computed in, and in later cycles while it is younger than
+    ``freshness`` seconds.
+
+    Parameters
+    ----------
+    freshness : float = 0
+        How long a result stays valid across cycles (in seconds), 0 to only share results within a cycle
+    """
+
+    def __init__(self, freshness: float = 0):
+        self.freshness = freshness
+        # key: (result, check time, cycle)
+        self._results: Dict[Tuple[str, str], Tuple[Any, float, int]] = {}
+        self._cycle = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(method: str, params: list) -> Tuple[str, str]:
+        return method, json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+    def begin_cycle(self) -> None:
+        self._cycle += 1
+        expired = time.monotonic() - self.freshness
+        self._results = {k: v for k, v in self._results.items() if v[1] > expired}
+
+    def run(self, method: str, params: list) -> Any:
+        """
+        Run a check method, or reuse its result
+
+        Parameters
+        ----------
+        method : str
+            Name of the method in METHODS
+        params : list
+            Positional parameters of the method
+
+        Returns
+        -------
+        Any
+            Result of the method
+        """
+        key = self.key(method, params)
+        cached = self._results.get(key)
+        if cached is not None and (cached[2] == self._cycle or cached[1] > time.monotonic() - self.freshness):
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        result = METHODS[method](*params)
+        self._results[key] = (result, time.monotonic(), self._cycle)
+        return result
@@ -1,16 +1,28 @@
 import os
 import json
 
+import transport
+import wire
+from schedule import AdaptivePolicy
+
 CFG_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
 
 
 class Config:
-    def __init__(self):
+    def __init__(self, path: str = CFG_FILE_PATH):
+        self.path = path
         self.config = {}
-        self.load_config()
+        self.load_config(path)
         self.server_url = self.config['general']['server']['url']
+        self.wire_format = self.config['general']['server'].get('wire_format', 'json')
+        self.content_type, self.encode_body = wire.get_codec(self.wire_format)
+        self.max_retries = self.config['general']['server'].get('max_retries', 2)
+        self.transport = self.config['general']['server'].get('transport', 'requests')
+        self.send = transport.get_transport(self.transport)
         self.sleep_interval = self.config['general']['local']['sleep_interval']
         self.require_root = self.config['general']['local']['require_root']
+        self.check_cache_ttl = self.config['general']['local'].get('check_cache_ttl', 0)
+        self.adaptive = AdaptivePolicy(**self.config['general']['local'].get('adaptive', {}))
         self.access_token = self.config['auth']['access_token']
         self.services = self.config['services']
 
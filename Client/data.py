@@ -1,3 +1,5 @@
+import hashlib
+import json
 from dataclasses import dataclass
 from enum import Enum
 
@@ -41,9 +43,30 @@ METHODS = {
     'dns': evaluate.dns_equals_this,
     'file': evaluate.file_exists,
     'pid': evaluate.check_pid,
+    'proc': evaluate.proc_running,
 }
 
 
+def service_fingerprint(description: str, data: dict | None) -> str:
+    """
+    Stable content hash of a service's description and data, must match the server's implementation
+
+    Parameters
+    ----------
+    description : str
+        Service description
+    data : dict | None
+        Service data
+
+    Returns
+    -------
+    str
+        Hex digest
+    """
+    canonical = json.dumps([description, data], sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
 @dataclass
 class Service:
     """
@@ -65,6 +88,8 @@ class Service:
         Service data, note that the data should be JSON serializable
     method : dict = None
         Service checking method, note that the method should be JSON serializable
+    fingerprint : str = ''
+        Content hash of description and data (see service_fingerprint), computed if empty
     """
 
     name: str
@@ -74,3 +99,8 @@ class Service:
     valid_until: int = 0
     data: dict = None
     method: dict = None
+    fingerprint: str = ''
+
+    def __post_init__(self):
+        if not self.fingerprint:
+            self.fingerprint = service_fingerprint(self.description, self.data)
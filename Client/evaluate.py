@@ -3,8 +3,6 @@ import subprocess
 import os
 from typing import Literal
 
-import requests
-
 
 def has_root_privilege() -> bool:
     """
@@ -80,6 +78,8 @@ def http_get(url: str) -> bool:
     bool
         True if the request can be sent, False otherwise
     """
+    # imported here, agents without HTTP checks do not load requests
+    import requests
     try:
         r = requests.get(url, timeout=5)
         return isinstance(r.status_code, int)
@@ -109,6 +109,24 @@ def check_pid(pid: int) -> bool:
         return True
 
 
+def proc_running(spec: str | dict) -> bool:
+    """
+    Check if a process is running, using the /proc scan shared by all checks of a cycle
+
+    Parameters
+    ----------
+    spec : str | dict
+        Process name, or a dict with one of ``name``, ``cmdline`` (regular expression) or ``pidfile``
+
+    Returns
+    -------
+    bool
+        True if at least one process matches, False otherwise
+    """
+    from procscan import SCANNER
+    return len(SCANNER.match(spec)) > 0
+
+
 def ping_test(host: str) -> bool:
     """
     Check if a host can be pinged
@@ -3,6 +3,7 @@ import time
 from evaluate import has_root_privilege
 from config import Config
 from service import Services
+from watch import FileWatcher
 
 
 def main():
@@ -11,8 +12,18 @@ def main():
         print('This program requires root privilege')
         exit(1)
     services = Services(config)
+    watcher = FileWatcher(config.path)
     while True:
         time.sleep(config.sleep_interval)
+        if watcher.changed():
+            try:
+                new_config = Config(config.path)
+                added, removed, changed = services.apply_config(new_config)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f'Config reload failed, keeping the previous one: {e!r}')
+            else:
+                config = new_config
+                print(f'Config reloaded: {len(added)} added, {len(removed)} removed, {len(changed)} changed')
         services.evaluate_services()
 
 
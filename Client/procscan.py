@@ -0,0 +1,148 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+@dataclass
+class ProcessSample:
+    """
+    A process seen by the scanner
+
+    Attributes
+    ----------
+    pid : int
+        Process ID
+    name : str
+        Process name (``comm``, at most 15 characters)
+    cpu_time : float
+        User and system CPU time consumed so far (in seconds)
+    rss : int
+        Resident set size (in bytes)
+    cmdline : str | None = None
+        Command line with arguments separated by spaces, read on first use
+    """
+
+    pid: int
+    name: str
+    cpu_time: float
+    rss: int
+    cmdline: str | None = None
+
+
+class ProcScanner:
+    """
+    Scans /proc at most once per cycle and matches processes against check specs
+
+    A spec is either a process name, or a dict with one of ``name``, ``cmdline`` (a regular expression searched
+    in the command line) or ``pidfile``.
+
+    Parameters
+    ----------
+    proc_root : str = '/proc'
+        Mount point of procfs
+    """
+
+    def __init__(self, proc_root: str = '/proc'):
+        self.proc_root = proc_root
+        self._processes: Dict[int, ProcessSample] | None = None
+        self._patterns: Dict[str, re.Pattern] = {}
+
+    def begin_cycle(self) -> None:
+        self._processes = None
+
+    def _read_stat(self, pid: int) -> ProcessSample | None:
+        try:
+            with open(f'{self.proc_root}/{pid}/stat', 'rb') as f:
+                raw = f.read()
+        except OSError:
+            # the process exited during the scan
+            return None
+        # the name is in parentheses and may itself contain spaces or parentheses
+        start, end = raw.index(b'('), raw.rindex(b')')
+        fields = raw[end + 2:].split()
+        # fields[0] is the state (field 3 of proc(5)): utime is 14, stime 15, rss 24
+        cpu_time = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        rss = int(fields[21]) * PAGE_SIZE
+        return ProcessSample(pid, raw[start + 1:end].decode('utf-8', 'replace'), cpu_time, rss)
+
+    @property
+    def processes(self) -> Dict[int, ProcessSample]:
+        if self._processes is None:
+            processes = {}
+            with os.scandir(self.proc_root) as it:
+                for entry in it:
+                    if entry.name.isdigit():
+                        sample = self._read_stat(int(entry.name))
+                        if sample is not None:
+                            processes[sample.pid] = sample
+            self._processes = processes
+        return self._processes
+
+    def _cmdline(self, sample: ProcessSample) -> str:
+        if sample.cmdline is None:
+            try:
+                with open(f'{self.proc_root}/{sample.pid}/cmdline', 'rb') as f:
+                    sample.cmdline = f.read().rstrip(b'\0').replace(b'\0', b' ').decode('utf-8', 'replace')
+            except OSError:
+                sample.cmdline = ''
+        return sample.cmdline
+
+    def match(self, spec: str | dict) -> List[ProcessSample]:
+        """
+        Find the processes matching a spec
+
+        Parameters
+        ----------
+        spec : str | dict
+            Process name, or a dict with one of ``name``, ``cmdline`` or ``pidfile``
+
+        Returns
+        -------
+        List[ProcessSample]
+            Matching processes, empty if none
+        """
+        if isinstance(spec, str):
+            spec = {'name': spec}
+        processes = self.processes
+        if 'pidfile' in spec:
+            try:
+                with open(spec['pidfile'], 'r') as f:
+                    pid = int(f.read().strip())
+            except (OSError, ValueError):
+                return []
+            return [processes[pid]] if pid in processes else []
+        if 'cmdline' in spec:
+            pattern = self._patterns.get(spec['cmdline'])
+            if pattern is None:
+                pattern = self._patterns[spec['cmdline']] = re.compile(spec['cmdline'])
+            return [p for p in processes.values() if pattern.search(self._cmdline(p))]
+        return [p for p in processes.values() if p.name == spec['name']]
+
+    def metrics(self, spec: str | dict) -> dict:
+        """
+        Resource usage of the processes matching a spec
+
+        Parameters
+        ----------
+        spec : str | dict
+            See match()
+
+        Returns
+        -------
+        dict
+            Number of processes, total CPU time (in seconds) and total RSS (in bytes)
+        """
+        matched = self.match(spec)
+        return {
+            'processes': len(matched),
+            'cpu_time': round(sum(p.cpu_time for p in matched), 2),
+            'rss': sum(p.rss for p in matched),
+        }
+
+
+# shared by every proc check, Services starts a new cycle before each round of checks
+SCANNER = ProcScanner()
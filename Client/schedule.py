@@ -0,0 +1,97 @@
+from collections import deque
+from dataclasses import dataclass
+
+
+@dataclass
+class AdaptivePolicy:
+    """
+    Adaptive check scheduling settings
+
+    Attributes
+    ----------
+    enabled : bool = False
+        Whether services are checked adaptively instead of every valid_period
+    min_interval : float = 10
+        Check interval of failing, recovering or flapping services (in seconds)
+    max_interval : float = 600
+        Upper bound of the check interval of healthy and stable services (in seconds)
+    backoff : float = 2
+        Factor applied to the check interval after each check of a healthy and stable service
+    flap_window : int = 5
+        Number of recent results considered (N)
+    flap_threshold : int = 3
+        Number of recent results that must agree before a state change is reported (K)
+    """
+
+    enabled: bool = False
+    min_interval: float = 10
+    max_interval: float = 600
+    backoff: float = 2
+    flap_window: int = 5
+    flap_threshold: int = 3
+
+
+class AdaptiveSchedule:
+    """
+    Check schedule and reported state of one service
+
+    The reported state only changes once ``flap_threshold`` of the last ``flap_window`` results agree with the
+    new state, and the check interval grows while the service is healthy and stable and drops to
+    ``min_interval`` as soon as it is not.
+
+    Parameters
+    ----------
+    policy : AdaptivePolicy
+        Scheduling settings
+    base_interval : float
+        Initial check interval, usually the service's valid_period (in seconds)
+    """
+
+    def __init__(self, policy: AdaptivePolicy, base_interval: float):
+        self.policy = policy
+        self.base_interval = base_interval
+        self.interval = base_interval
+        self.history = deque(maxlen=policy.flap_window)
+        # state as last reported to the server, None before the first check
+        self.reported: bool | None = None
+        self.next_check = 0.0
+        self.last_notified = 0.0
+        self.last_repair = 0.0
+
+    def check_due(self, now: float) -> bool:
+        return now >= self.next_check
+
+    def heartbeat_due(self, now: float) -> bool:
+        return now - self.last_notified >= self.base_interval
+
+    def record(self, result: bool, now: float) -> bool:
+        """
+        Record a check result and schedule the next check
+
+        Parameters
+        ----------
+        result : bool
+            Result of the check
+        now : float
+            Time of the check
+
+        Returns
+        -------
+        bool
+            True if the reported state changed
+        """
+        self.history.append(result)
+        changed = False
+        if self.reported is None:
+            self.reported = result
+            changed = True
+        elif result != self.reported and self.history.count(result) >= self.policy.flap_threshold:
+            self.reported = result
+            changed = True
+        stable = len(self.history) == self.history.maxlen and self.history.count(self.reported) == len(self.history)
+        if self.reported and stable:
+            self.interval = min(max(self.interval, self.base_interval) * self.policy.backoff, self.policy.max_interval)
+        else:
+            self.interval = self.policy.min_interval
+        self.next_check = now + self.interval
+        return changed
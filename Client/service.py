@@ -1,14 +1,77 @@
+import random
 import socket
 import time
-
-import requests
+from email.utils import parsedate_to_datetime
+from typing import Set, Tuple
 
 from config import Config
 
-from data import Service, ServiceType, METHODS
+from checks import CheckCache
+from data import Service, ServiceType
+from schedule import AdaptiveSchedule
 from evaluate import get_local_ip
 
 
+# monotonic time before which the server asked not to be contacted again (Retry-After)
+_not_before = 0.0
+
+
+def _retry_after(resp) -> float | None:
+    value = resp.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def post(config: Config, path: str, data: dict):
+    """
+    Send a request to the server, encoded with the configured wire format
+
+    A 429 or 503 response with Retry-After holds back every request until the given time, the request is then
+    retried up to ``config.max_retries`` times.
+
+    Parameters
+    ----------
+    config : Config
+        The configuration that contains the server URL, etc.
+    path : str
+        Path of the endpoint, e.g. /api/srv/renew
+    data : dict
+        Request body
+
+    Returns
+    -------
+    requests.Response | transport.Response
+        The server's response, depending on the configured transport
+    """
+    headers = {
+        'Content-Type': config.content_type,
+        'Accept': f'{config.content_type}, application/json;q=0.5',
+    }
+    global _not_before
+    body = config.encode_body(data)
+    for _ in range(config.max_retries + 1):
+        wait = _not_before - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        resp = config.send(f'{config.server_url}{path}', headers, body)
+        if resp.status_code not in (429, 503):
+            return resp
+        delay = _retry_after(resp)
+        if delay is None:
+            return resp
+        # jitter, so that agents told to wait the same time do not come back together
+        _not_before = time.monotonic() + delay * random.uniform(1, 1.5)
+    return resp
+
+
 def handle_dns(service: Service, config: Config) -> bool:
     """
     Handle DNS service when ip not match this host
@@ -29,11 +92,7 @@ def handle_dns(service: Service, config: Config) -> bool:
         this_ip = get_local_ip(service.method['param'][-1])
     except socket.gaierror:
         return False
-    url = f'{config.server_url}/api/dns/update'
     rec_type = 'A' if service.method['param'][-1] == 4 else 'AAAA'
-    headers = {
-        'Content-Type': 'application/json',
-    }
     data = {
         'token': config.access_token,
         'domain': service.data['domain'],
@@ -46,13 +105,15 @@ def handle_dns(service: Service, config: Config) -> bool:
         data['proxied'] = service.data['proxied']
     if 'priority' in service.data:
         data['priority'] = service.data['priority']
-    resp = requests.post(url, headers=headers, json=data)
-    if resp.status_code == 200:
+    resp = post(config, '/api/dns/update', data)
+    # 202: the server queued the update behind its upstream rate limit
+    if resp.status_code in (200, 202):
         return True
     return False
 
 
-def notify_server(service: Service, config: Config, status: bool, first_run: bool = False) -> bool:
+def notify_server(service: Service, config: Config, status: bool, first_run: bool = False,
+                  latency: float | None = None) -> bool:
     """
     Notify the server that this service's status
 
@@ -66,16 +127,15 @@ def notify_server(service: Service, config: Config, status: bool, first_run: boo
         The status of the service
     first_run : bool = False
         Whether this is the first run, by default False
+    latency : float | None = None
+        Duration of the check the status comes from (in seconds), None if no check was run
 
     Returns
     -------
     bool
         True if success
     """
-    url = f'{config.server_url}/api/srv/{"renew" if not first_run else "reg"}'
-    headers = {
-        'Content-Type': 'application/json',
-    }
+    path = f'/api/srv/{"renew" if not first_run else "reg"}'
     data = {
         'token': config.access_token,
         'name': service.name,
@@ -83,36 +143,187 @@ def notify_server(service: Service, config: Config, status: bool, first_run: boo
         'valid': status,
     }
     if first_run:
+        # the server only asks for description and data when its fingerprint differs
+        data['fingerprint'] = service.fingerprint
+    if latency is not None:
+        data['latency'] = round(latency, 4)
+    if service.type == ServiceType.DNS:
+        # lets the server reconcile the record towards this host's address
+        try:
+            data['address'] = get_local_ip(service.method['param'][-1])
+        except socket.gaierror:
+            pass
+    if service.method['name'] == 'proc':
+        from procscan import SCANNER
+        data['metrics'] = SCANNER.metrics(*service.method['param'])
+    resp = post(config, path, data)
+    if first_run and resp.status_code == 409:
         data['description'] = service.description
         data['data'] = service.data
-    resp = requests.post(url, headers=headers, json=data)
+        resp = post(config, path, data)
     if resp.status_code == 200:
         return True
     return False
 
 
+def unregister_from_server(service: Service, config: Config) -> bool:
+    """
+    Tell the server that this service is no longer monitored
+
+    Parameters
+    ----------
+    service : Service
+        The service to remove
+    config : Config
+        The configuration that contains the server URL, etc.
+
+    Returns
+    -------
+    bool
+        True if success
+    """
+    data = {
+        'token': config.access_token,
+        'name': service.name,
+        'type': service.type.value,
+    }
+    resp = post(config, '/api/srv/unreg', data)
+    return resp.status_code in (200, 404)
+
+
 class Services:
     def __init__(self, config: Config):
         self.config = config
-        self.services_dict = config.services
+        # name(str): service entry of the config file, kept to diff reloaded configs against
+        self.services_dict = {}
         self.services = {}
+        # name(str): AdaptiveSchedule, empty unless adaptive scheduling is enabled
+        self.schedules = {}
+        self.check_cache = CheckCache(config.check_cache_ttl)
         self.parse_services()
         self.evaluate_services(first_run=True)
 
+    @staticmethod
+    def parse_service(service: dict) -> Service:
+        service = dict(service)
+        service['type'] = ServiceType(service['type'])
+        service['valid_until'] = int(time.time() + service['valid_period'])
+        return Service(**service)
+
     def parse_services(self) -> None:
-        for service in self.services_dict:
-            service['type'] = ServiceType(service['type'])
-            service['valid_until'] = int(time.time() + service['valid_period'])
-            self.services[service['name']] = Service(**service)
+        for service in self.config.services:
+            self.services_dict[service['name']] = service
+            self.services[service['name']] = self.parse_service(service)
+        self.reset_schedules()
+
+    def reset_schedules(self, names: Set[str] | None = None) -> None:
+        if not self.config.adaptive.enabled:
+            self.schedules.clear()
+            return
+        for name in self.services if names is None else names:
+            self.schedules[name] = AdaptiveSchedule(self.config.adaptive, self.services[name].valid_period)
+
+    def apply_config(self, config: Config) -> Tuple[Set[str], Set[str], Set[str]]:
+        """
+        Switch to a reloaded config, touching only the services that differ
+
+        New services are registered, removed ones unregistered and changed ones re-registered, unchanged
+        services keep their schedule unless the adaptive scheduling settings changed.
+
+        Parameters
+        ----------
+        config : Config
+            The reloaded configuration
+
+        Returns
+        -------
+        Tuple[Set[str], Set[str], Set[str]]
+            Names of the added, removed and changed services
+
+        Raises
+        ------
+        ValueError, KeyError, TypeError
+            If a service entry is invalid, nothing is applied in that case
+        """
+        new_dict = {service['name']: service for service in config.services}
+        added = new_dict.keys() - self.services_dict.keys()
+        removed = self.services_dict.keys() - new_dict.keys()
+        changed = {name for name in new_dict.keys() & self.services_dict.keys()
+                   if new_dict[name] != self.services_dict[name]}
+        # parse before touching anything so that an invalid entry leaves the current services in place
+        parsed = {name: self.parse_service(new_dict[name]) for name in added | changed}
+        policy_changed = config.adaptive != self.config.adaptive
+        # the local state is switched completely before the server is contacted, so that a failing request
+        # cannot leave a half-applied config behind
+        stale = [self.services[name] for name in removed]
+        stale.extend(self.services[name] for name in changed if self.services[name].type != parsed[name].type)
+        self.config = config
+        self.check_cache.freshness = config.check_cache_ttl
+        for name in removed:
+            del self.services[name]
+            self.schedules.pop(name, None)
+        self.services.update(parsed)
+        self.services_dict = new_dict
+        self.reset_schedules(None if policy_changed else set(parsed))
+        # best effort, the new config stays applied if the server cannot be reached
+        for srv in stale:
+            try:
+                unregister_from_server(srv, config)
+            except Exception as e:
+                print(f'Unregistering {srv.name} failed: {e!r}')
+        for srv in parsed.values():
+            try:
+                self.evaluate_service(srv, first_run=True)
+            except Exception as e:
+                print(f'Registering {srv.name} failed: {e!r}')
+        return added, removed, changed
+
+    def evaluate_service(self, srv: Service, first_run: bool = False) -> None:
+        schedule = self.schedules.get(srv.name)
+        if schedule is not None:
+            self.evaluate_service_adaptive(srv, schedule, first_run)
+            return
+        start = time.perf_counter()
+        res = self.check_cache.run(srv.method['name'], srv.method['param'])
+        latency = time.perf_counter() - start
+        if res:
+            srv.valid_until = int(time.time() + srv.valid_period)
+        else:
+            if srv.type == ServiceType.DNS:
+                res = handle_dns(srv, self.config)
+        notify_server(srv, self.config, res, first_run, latency)
+
+    def evaluate_service_adaptive(self, srv: Service, schedule: AdaptiveSchedule, first_run: bool = False) -> None:
+        now = time.time()
+        changed = False
+        latency = None
+        if first_run or schedule.check_due(now):
+            start = time.perf_counter()
+            res = bool(self.check_cache.run(srv.method['name'], srv.method['param']))
+            latency = time.perf_counter() - start
+            changed = schedule.record(res, now)
+        valid = schedule.reported
+        if not valid and srv.type == ServiceType.DNS and (changed or now - schedule.last_repair >= srv.valid_period):
+            # at most one DNS update per valid_period while the record is confirmed wrong
+            schedule.last_repair = now
+            valid = handle_dns(srv, self.config)
+        if first_run or changed or schedule.heartbeat_due(now):
+            if notify_server(srv, self.config, valid, first_run, latency):
+                schedule.last_notified = now
+
+    def is_due(self, srv: Service, now: float) -> bool:
+        schedule = self.schedules.get(srv.name)
+        if schedule is None:
+            return now >= srv.valid_until
+        return schedule.check_due(now) or schedule.heartbeat_due(now)
 
     def evaluate_services(self, first_run: bool = False) -> None:
+        self.check_cache.begin_cycle()
+        # the process scanner is only imported by agents with process checks
+        if any(srv.method['name'] == 'proc' for srv in self.services.values()):
+            from procscan import SCANNER
+            SCANNER.begin_cycle()
         for name, srv in self.services.items():
-            if time.time() < srv.valid_until and not first_run:
+            if not first_run and not self.is_due(srv, time.time()):
                 continue
-            res = METHODS[srv.method['name']](*srv.method['param'])
-            if res:
-                srv.valid_until = int(time.time() + srv.valid_period)
-            else:
-                if srv.type == ServiceType.DNS:
-                    res = handle_dns(srv, self.config)
-            notify_server(srv, self.config, res, first_run)
+            self.evaluate_service(srv, first_run)
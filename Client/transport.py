@@ -0,0 +1,136 @@
+"""
+HTTP transport of the requests sent to the server, selected by general.server.transport
+"""
+import http.client
+import threading
+from typing import Callable, Dict, Tuple
+from urllib.parse import urlsplit
+
+
+class Response:
+    """
+    Response of the http.client transport, with the attributes of requests.Response the agent uses
+
+    Attributes
+    ----------
+    status_code : int
+        HTTP status
+    headers : http.client.HTTPMessage
+        Response headers, case-insensitive
+    content : bytes
+        Response body
+    """
+
+    def __init__(self, status_code: int, headers: http.client.HTTPMessage, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+
+class HttpClientTransport:
+    """
+    Stdlib only transport, keeps one connection per server open between requests
+
+    Parameters
+    ----------
+    timeout : float = 30
+        Socket timeout (in seconds)
+    """
+
+    def __init__(self, timeout: float = 30):
+        self.timeout = timeout
+        # (scheme, netloc): connection
+        self._connections: Dict[Tuple[str, str], http.client.HTTPConnection] = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        conn = self._connections.get((scheme, netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = self._connections[(scheme, netloc)] = cls(netloc, timeout=self.timeout)
+        return conn
+
+    def post(self, url: str, headers: dict, data: bytes) -> Response:
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+        with self._lock:
+            # a kept-alive connection may have been closed by the server, it is reopened once
+            for attempt in range(2):
+                conn = self._connection(parts.scheme, parts.netloc)
+                try:
+                    conn.request('POST', path, body=data, headers=headers)
+                    resp = conn.getresponse()
+                    content = resp.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    del self._connections[(parts.scheme, parts.netloc)]
+                    if attempt:
+                        raise
+                    continue
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    del self._connections[(parts.scheme, parts.netloc)]
+                    raise
+                if resp.will_close:
+                    conn.close()
+                    del self._connections[(parts.scheme, parts.netloc)]
+                return Response(resp.status, resp.headers, content)
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+
+def _requests_transport() -> Callable[[str, dict, bytes], object]:
+    import requests
+
+    def post(url: str, headers: dict, data: bytes):
+        return requests.post(url, headers=headers, data=data)
+
+    return post
+
+
+def _http_client_transport() -> Callable[[str, dict, bytes], Response]:
+    return HttpClientTransport().post
+
+
+# transport: function returning post(url, headers, data), the requests package is only imported if used
+TRANSPORTS: Dict[str, Callable[[], Callable[[str, dict, bytes], object]]] = {
+    'requests': _requests_transport,
+    'http.client': _http_client_transport,
+}
+
+
+def get_transport(name: str) -> Callable[[str, dict, bytes], object]:
+    """
+    Get the function sending a POST request with a transport
+
+    Parameters
+    ----------
+    name : str
+        One of 'requests' or 'http.client'
+
+    Returns
+    -------
+    Callable[[str, dict, bytes], object]
+        post(url, headers, data), returning a requests.Response or a Response
+
+    Raises
+    ------
+    ValueError
+        If the transport is unknown or its package is not installed
+    """
+    if name not in TRANSPORTS:
+        raise ValueError(f'Unknown transport: {name}')
+    try:
+        return TRANSPORTS[name]()
+    except ImportError as e:
+        raise ValueError(f'Transport {name} requires the {e.name} package') from e
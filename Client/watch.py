@@ -0,0 +1,98 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class FileWatcher:
+    """
+    Detect changes of a file, with inotify when available and mtime polling otherwise
+
+    The parent directory is watched so that editors replacing the file (write to a temporary file, then rename)
+    are detected as well.
+
+    Parameters
+    ----------
+    path : str
+        The file to watch
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._name = os.fsencode(os.path.basename(self.path))
+        self._stamp = self._stat()
+        self._fd = self._inotify_watch()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def _stat(self) -> tuple | None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _inotify_watch(self) -> int | None:
+        lib_name = ctypes.util.find_library('c')
+        if lib_name is None:
+            return None
+        try:
+            libc = ctypes.CDLL(lib_name, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(os.path.dirname(self.path)), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _inotify_pending(self) -> bool:
+        touched = False
+        while True:
+            try:
+                buf = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return touched
+            offset = 0
+            while offset < len(buf):
+                _, _, _, length = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                touched |= name == self._name
+
+    def changed(self) -> bool:
+        """
+        Check if the file changed since the last call, never blocks
+
+        Returns
+        -------
+        bool
+            True if the file was modified, replaced or (re)created
+        """
+        if self._fd is not None and not self._inotify_pending():
+            return False
+        stamp = self._stat()
+        if stamp == self._stamp or stamp is None:
+            return False
+        self._stamp = stamp
+        return True
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,57 @@
+"""
+Encoding of request bodies sent to the server, selected by general.server.wire_format
+"""
+import json
+from typing import Any, Callable, Dict, Tuple
+
+
+def _json_codec() -> Tuple[str, Callable[[Any], bytes]]:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    return 'application/json', dumps
+
+
+def _msgpack_codec() -> Tuple[str, Callable[[Any], bytes]]:
+    import msgpack
+    return 'application/msgpack', msgpack.packb
+
+
+def _cbor_codec() -> Tuple[str, Callable[[Any], bytes]]:
+    import cbor2
+    return 'application/cbor', cbor2.dumps
+
+
+# wire format: function importing the encoder on first use and returning (mime type, dumps)
+FORMATS: Dict[str, Callable[[], Tuple[str, Callable[[Any], bytes]]]] = {
+    'json': _json_codec,
+    'msgpack': _msgpack_codec,
+    'cbor': _cbor_codec,
+}
+
+
+def get_codec(wire_format: str) -> Tuple[str, Callable[[Any], bytes]]:
+    """
+    Get the encoder of a wire format
+
+    Parameters
+    ----------
+    wire_format : str
+        One of 'json', 'msgpack' or 'cbor'
+
+    Returns
+    -------
+    Tuple[str, Callable[[Any], bytes]]
+        Mime type and encoding function
+
+    Raises
+    ------
+    ValueError
+        If the wire format is unknown or its package is not installed
+    """
+    if wire_format not in FORMATS:
+        raise ValueError(f'Unknown wire format: {wire_format}')
+    try:
+        return FORMATS[wire_format]()
+    except ImportError as e:
+        raise ValueError(f'Wire format {wire_format} requires the {e.name} package') from e
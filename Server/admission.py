@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from utils import TokenBucket
+
+
+@dataclass
+class AdmissionConfig:
+    """
+    Request budgets of the server
+
+    Attributes
+    ----------
+    rate : float = 200
+        Sustained requests per second over all clients, 0 for no global budget
+    burst : float = 400
+        Requests the server accepts at once after being idle
+    client_rate : float = 5
+        Sustained requests per second of one client, 0 for no per-client budget
+    client_burst : float = 20
+        Requests an idle client may make at once
+    max_clients : int = 4096
+        Number of per-client budgets kept, the least recently seen client is forgotten first
+    max_in_flight : int = 16
+        Requests handled at the same time, 0 for no limit
+    max_queued : int = 64
+        Requests waiting for a handling slot, further requests are rejected right away
+    queue_timeout : float = 5
+        Maximum time a request waits for a handling slot (in seconds)
+    trusted_proxies : List[str] = []
+        Addresses of the reverse proxies in front of the server. Clients are told apart by their address, so
+        behind a proxy that is not listed here all clients share the proxy's budget. For requests coming from
+        a listed proxy the last address of X-Forwarded-For is used instead.
+    """
+
+    rate: float = 200
+    burst: float = 400
+    client_rate: float = 5
+    client_burst: float = 20
+    max_clients: int = 4096
+    max_in_flight: int = 16
+    max_queued: int = 64
+    queue_timeout: float = 5
+    trusted_proxies: List[str] = field(default_factory=list)
+
+
+class AdmissionControl:
+    """
+    Decides whether a request is handled, based on the global and per-client budgets and the number of
+    requests in flight
+
+    Parameters
+    ----------
+    config : AdmissionConfig
+        Budgets and limits
+    """
+
+    # status codes of the rejections
+    RATE_LIMITED = 429
+    OVERLOADED = 503
+
+    def __init__(self, config: AdmissionConfig):
+        self.config = config
+        self.bucket = TokenBucket(config.rate, config.burst) if config.rate > 0 else None
+        self._clients: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(config.max_in_flight) if config.max_in_flight > 0 else None
+        self.queued = 0
+        self.rejected = {self.RATE_LIMITED: 0, self.OVERLOADED: 0}
+
+    def _client_bucket(self, client: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._clients.get(client)
+            if bucket is None:
+                bucket = self._clients[client] = TokenBucket(self.config.client_rate, self.config.client_burst)
+                if len(self._clients) > self.config.max_clients:
+                    self._clients.popitem(last=False)
+            else:
+                self._clients.move_to_end(client)
+            return bucket
+
+    def _reject(self, status: int, retry_after: float) -> Tuple[int, float]:
+        with self._lock:
+            self.rejected[status] += 1
+        return status, retry_after
+
+    def enter(self, client: str) -> Tuple[int, float]:
+        """
+        Admit a request, an admitted request must be followed by ``leave``
+
+        Parameters
+        ----------
+        client : str
+            Key of the client's budget
+
+        Returns
+        -------
+        Tuple[int, float]
+            0 and 0 if the request is admitted, otherwise the status to reject it with and the time after
+            which the client may retry (in seconds)
+        """
+        if self.config.client_rate > 0:
+            wait = self._client_bucket(client).try_acquire()
+            if wait > 0:
+                return self._reject(self.RATE_LIMITED, wait)
+        if self.bucket is not None:
+            wait = self.bucket.try_acquire()
+            if wait > 0:
+                return self._reject(self.RATE_LIMITED, wait)
+        if self._slots is None:
+            return 0, 0.0
+        if self._slots.acquire(blocking=False):
+            return 0, 0.0
+        with self._lock:
+            full = self.queued >= self.config.max_queued
+            if not full:
+                self.queued += 1
+        if full:
+            return self._reject(self.OVERLOADED, self.config.queue_timeout)
+        try:
+            admitted = self._slots.acquire(timeout=self.config.queue_timeout)
+        finally:
+            with self._lock:
+                self.queued -= 1
+        if not admitted:
+            return self._reject(self.OVERLOADED, self.config.queue_timeout)
+        return 0, 0.0
+
+    def leave(self) -> None:
+        if self._slots is not None:
+            self._slots.release()
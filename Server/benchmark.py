@@ -0,0 +1,239 @@
+"""
+Micro benchmarks of the server internals, run from this directory::
+
+    python benchmark.py serialization --count 10000 100000
+    python benchmark.py memory --count 100000
+    python benchmark.py dns-burst --writes 200 --records 50
+    python benchmark.py startup --count 100000
+"""
+import argparse
+import dataclasses
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from enum import Enum
+from typing import Callable, List
+
+from cloudflare_v4_api import dns
+from cloudflare_v4_api.emulator import CloudflareEmulator, EmulatorServer, FaultConfig
+from data import Service, ServiceType
+from dns_scheduler import DnsWrite, DnsWriteScheduler
+from service import RegisteredServices
+import serialization
+
+
+class _LegacyEncoder(json.JSONEncoder):
+    # the encoder the store used before the serialization module
+    def default(self, o):
+        if dataclasses.is_dataclass(o):
+            d = dataclasses.asdict(o)
+            for k, v in d.items():
+                if isinstance(v, Enum):
+                    d[k] = v.value
+            return d
+        return super().default(o)
+
+
+@dataclasses.dataclass
+class _LegacyService:
+    # the plain dataclass Service used before the slotted representation
+    name: str
+    type: ServiceType
+    description: str = ''
+    create_time: int = 0
+    valid: bool = True
+    valid_until: int = 0
+    data: dict = None
+
+
+def _legacy_status(services: dict) -> str:
+    result = {}
+    for name, srv in services.items():
+        status = 'offline' if srv.valid else ('online' if srv.valid_until > time.time() else 'unknown/expired')
+        r = {'type': srv.type.name, 'description': srv.description, 'status': status,
+             'create_time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(srv.create_time)), 'data': srv.data}
+        result[name] = r
+    return json.dumps(result)
+
+
+def make_services(count: int, compact: bool = False, cls: type = Service) -> RegisteredServices:
+    registered = RegisteredServices(compact)
+    types = list(ServiceType)
+    now = int(time.time())
+    for i in range(count):
+        # names and descriptions are built at runtime like the ones parsed from requests, so never shared
+        name = f'service_{i}'
+        srv = cls(name, types[i % len(types)], f'description of {types[i % len(types)].value} service', now - i,
+                  i % 7 != 0, now + 120, {'domain': f'host{i}.example.com'} if i % 4 == 0 else {})
+        if cls is Service:
+            registered.register_service(name, srv, save=False)
+        else:
+            registered.services[name] = srv
+    return registered
+
+
+def timeit(func: Callable[[], object], repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_serialization(counts: List[int]) -> None:
+    print(f'serialization backend: {serialization.BACKEND}')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data_store.jsonl')
+        for count in counts:
+            registered = make_services(count)
+            legacy = make_services(count, cls=_LegacyService).services
+
+            def legacy_save():
+                with open(path, 'w') as f:
+                    json.dump(legacy, f, indent=4, cls=_LegacyEncoder)
+
+            rows = [
+                ('save (legacy)', timeit(legacy_save)),
+                ('save', timeit(lambda: registered.save(path))),
+                ('status (legacy)', timeit(lambda: _legacy_status(legacy))),
+                ('status', timeit(lambda: serialization.dumps(registered.status_report(True)))),
+            ]
+            for label, seconds in rows:
+                print(f'{count:>8} services  {label:<16} {seconds * 1000:10.1f} ms')
+
+
+def bench_memory(counts: List[int]) -> None:
+    variants = [
+        ('dataclass (legacy)', lambda n: make_services(n, cls=_LegacyService)),
+        ('slotted', lambda n: make_services(n)),
+        ('compact', lambda n: make_services(n, compact=True)),
+    ]
+    for count in counts:
+        for label, build in variants:
+            tracemalloc.start()
+            registered = build(count)
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'{count:>8} services  {label:<20} {current / 2 ** 20:8.1f} MiB  '
+                  f'{current / count:6.0f} B/service')
+            del registered
+
+
+def bench_startup(counts: List[int]) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'data_store.json')
+        snapshot_path = os.path.join(tmp, 'data_store.jsonl')
+        history_path = os.path.join(tmp, 'history_store.json')
+        for count in counts:
+            registered = make_services(count)
+            with open(legacy_path, 'wb') as f:
+                f.write(serialization.dumps(registered.services))
+            registered.save(snapshot_path)
+            del registered
+
+            def legacy_load():
+                RegisteredServices(history_path=history_path).load(os.path.join(tmp, 'missing'), legacy_path)
+
+            def snapshot_load():
+                RegisteredServices(history_path=history_path).load(snapshot_path, legacy_path)
+
+            def background_load():
+                # time until load returns and requests can be served, plus one lookup of a name not decoded yet
+                registered = RegisteredServices(history_path=history_path)
+                registered.load(snapshot_path, legacy_path, background=True)
+                registered.get_service(f'service_{count - 1}')
+                return registered
+
+            rows = [
+                ('load (legacy)', timeit(legacy_load)),
+                ('load (snapshot)', timeit(snapshot_load)),
+            ]
+            start = time.perf_counter()
+            registered = background_load()
+            rows.append(('ready (background)', time.perf_counter() - start))
+            registered.loaded.wait()
+            rows.append(('loaded (background)', time.perf_counter() - start))
+            for label, seconds in rows:
+                print(f'{count:>8} services  {label:<20} {seconds * 1000:10.1f} ms')
+
+
+def _direct_write(write: DnsWrite) -> bool:
+    # what a request thread did before the scheduler: list the records, then update or create
+    try:
+        records = dns.get_all_dns_record(write.zone_id, write.email, write.api_key, name=write.name,
+                                         rec_type=write.rec_type)
+        if records is None:
+            return False
+        if records:
+            return dns.update_dns_record(write.zone_id, write.email, write.api_key, records[0]['id'], write.rec_type,
+                                         write.name, write.content, write.ttl) is not None
+        return dns.create_dns_record(write.zone_id, write.email, write.api_key, write.rec_type, write.name,
+                                     write.content, write.ttl) is not None
+    except (ValueError, KeyError):
+        return False
+
+
+def bench_dns_burst(writes: int, records: int, latency: float, rate_limit: int, rate_window: float) -> None:
+    burst = [DnsWrite('zone', 'admin@example.com', 'key', 'A', f'host{i % records}.example.com',
+                      f'10.0.{i // 250}.{i % 250}') for i in range(writes)]
+    for label in ('direct', 'scheduler'):
+        emulator = CloudflareEmulator(FaultConfig(latency=latency, rate_limit=rate_limit, rate_window=rate_window))
+        with EmulatorServer(emulator) as server:
+            dns.set_base_url(server.base_url)
+            start = time.perf_counter()
+            if label == 'direct':
+                results = [False] * writes
+
+                def run(i: int):
+                    results[i] = _direct_write(burst[i])
+
+                threads = [threading.Thread(target=run, args=(i,)) for i in range(writes)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                failed = results.count(False)
+            else:
+                scheduler = DnsWriteScheduler(rate_limit / rate_window, min(10, rate_limit))
+                tickets = [scheduler.submit(w) for w in burst]
+                for ticket in tickets:
+                    ticket.wait()
+                failed = sum(ticket.result is None for ticket in tickets)
+            elapsed = time.perf_counter() - start
+        throttled = sum(v for k, v in emulator.stats.items() if k.endswith(' 429'))
+        print(f'{label:<10} {writes} writes to {records} records: {elapsed:6.2f} s, {failed} failed, '
+              f'{emulator.stats["total"]} upstream calls, {throttled} answered 429')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Server micro benchmarks')
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('serialization', help='store save and status render cost')
+    p.add_argument('--count', type=int, nargs='+', default=[10000, 100000])
+    p = sub.add_parser('memory', help='memory used by the registry')
+    p.add_argument('--count', type=int, nargs='+', default=[100000])
+    p = sub.add_parser('startup', help='store load time before requests can be served')
+    p.add_argument('--count', type=int, nargs='+', default=[10000, 100000])
+    p = sub.add_parser('dns-burst', help='simultaneous DNS updates against the API emulator')
+    p.add_argument('--writes', type=int, default=200)
+    p.add_argument('--records', type=int, default=50)
+    p.add_argument('--latency', type=float, default=0.02, help='emulated upstream latency (seconds)')
+    p.add_argument('--rate-limit', type=int, default=100, help='emulated upstream requests per window')
+    p.add_argument('--rate-window', type=float, default=10.0, help='emulated rate limit window (seconds)')
+    args = parser.parse_args()
+    if args.bench == 'serialization':
+        bench_serialization(args.count)
+    elif args.bench == 'memory':
+        bench_memory(args.count)
+    elif args.bench == 'startup':
+        bench_startup(args.count)
+    elif args.bench == 'dns-burst':
+        bench_dns_burst(args.writes, args.records, args.latency, args.rate_limit, args.rate_window)
+
+
+if __name__ == '__main__':
+    main()
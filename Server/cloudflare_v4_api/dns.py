@@ -2,10 +2,30 @@ from typing import List, Literal, Optional
 
 import requests
 
+API_BASE_URL = 'https://api.cloudflare.com/client/v4'
 
-def get_all_dns_record(zone_id: str, email: str, api_key: str) -> List[dict] | None:
+
+def set_base_url(url: str) -> None:
     """
-    Get all DNS records
+    Set the base URL of the Cloudflare v4 API, e.g. to point at a local emulator
+
+    Parameters
+    ----------
+    url : str
+        Base URL, without the trailing slash (e.g. http://127.0.0.1:8787/client/v4)
+    """
+    global API_BASE_URL
+    API_BASE_URL = url.rstrip('/')
+
+
+def get_all_dns_record(zone_id: str,
+                       email: str,
+                       api_key: str,
+                       name: Optional[str] = None,
+                       rec_type: Optional[str] = None,
+                       per_page: int = 100) -> List[dict] | None:
+    """
+    Get all DNS records, following pagination
 
     Parameters
     ----------
@@ -15,24 +35,43 @@ def get_all_dns_record(zone_id: str, email: str, api_key: str) -> List[dict] | N
         Email of the account
     api_key : str
         API key
+    name : str | None
+        Only return records with this name
+    rec_type : str | None
+        Only return records of this type
+    per_page : int
+        Number of records requested per page
 
     Returns
     -------
     List[Dict[str, str]]
         List of DNS records
     """
-    url = f'https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records'
+    url = f'{API_BASE_URL}/zones/{zone_id}/dns_records'
     headers = {
         'X-Auth-Email': email,
         'Authorization': f'Bearer {api_key}',
         'Content-Type': 'application/json'
     }
-    r = requests.get(url, headers=headers)
-    print(r.text)
-    if r.status_code == 200:
-        return r.json()['result']
-    else:
-        return None
+    params = {'per_page': per_page}
+    if name is not None:
+        params['name'] = name
+    if rec_type is not None:
+        params['type'] = rec_type
+    records = []
+    page = 1
+    while True:
+        params['page'] = page
+        r = requests.get(url, headers=headers, params=params)
+        print(r.text)
+        if r.status_code != 200:
+            return None
+        body = r.json()
+        records.extend(body['result'])
+        total_pages = body.get('result_info', {}).get('total_pages', 1)
+        if page >= total_pages:
+            return records
+        page += 1
 
 
 def create_dns_record(zone_id: str,
@@ -74,7 +113,7 @@ def create_dns_record(zone_id: str,
     dict
         Response
     """
-    url = f'https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records'
+    url = f'{API_BASE_URL}/zones/{zone_id}/dns_records'
     headers = {
         'X-Auth-Email': email,
         'Authorization': f'Bearer {api_key}',
@@ -138,7 +177,7 @@ def update_dns_record(zone_id: str,
     dict
         Response
     """
-    url = f'https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records/{identifier}'
+    url = f'{API_BASE_URL}/zones/{zone_id}/dns_records/{identifier}'
     headers = {
         'X-Auth-Email': email,
         'Authorization': f'Bearer {api_key}',
@@ -181,7 +220,7 @@ def delete_dns_record(zone_id: str, email: str, api_key: str, identifier: str) -
     dict
         Response
     """
-    url = f'https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records/{identifier}'
+    url = f'{API_BASE_URL}/zones/{zone_id}/dns_records/{identifier}'
     headers = {
         'X-Auth-Email': email,
         'Authorization': f'Bearer {api_key}',
@@ -190,3 +229,55 @@ def delete_dns_record(zone_id: str, email: str, api_key: str, identifier: str) -
     r = requests.delete(url, headers=headers)
     print(r.text)
     return r.json()['result']
+
+
+def batch_dns_records(zone_id: str,
+                      email: str,
+                      api_key: str,
+                      posts: Optional[List[dict]] = None,
+                      puts: Optional[List[dict]] = None,
+                      patches: Optional[List[dict]] = None,
+                      deletes: Optional[List[str]] = None) -> dict | None:
+    """
+    Apply several DNS record changes in one request, atomically
+
+    Parameters
+    ----------
+    zone_id : str
+        Zone ID
+    email : str
+        Email of the account
+    api_key : str
+        API key
+    posts : List[dict] | None
+        Records to create
+    puts : List[dict] | None
+        Records to overwrite, each with its ``id``
+    patches : List[dict] | None
+        Partial record updates, each with its ``id``
+    deletes : List[str] | None
+        Identifiers of the records to delete
+
+    Returns
+    -------
+    dict | None
+        Results per operation kind (deletes, patches, puts, posts), None on error
+    """
+    url = f'{API_BASE_URL}/zones/{zone_id}/dns_records/batch'
+    headers = {
+        'X-Auth-Email': email,
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    data = {
+        'deletes': [{'id': identifier} for identifier in deletes or []],
+        'patches': patches or [],
+        'puts': puts or [],
+        'posts': posts or [],
+    }
+    r = requests.post(url, headers=headers, json=data)
+    print(r.text)
+    if r.status_code == 200:
+        return r.json()['result']
+    else:
+        return None
@@ -0,0 +1,366 @@
+"""
+In-memory emulator of the Cloudflare v4 ``zones/{zone_id}/dns_records`` endpoints (including ``batch``)
+
+Used to exercise and benchmark the DNS code paths without a live account, e.g.::
+
+    python -m cloudflare_v4_api.emulator --port 8787 --latency 0.05 --error-429 0.01
+
+and then point the server at it with ``general.dns_api_url`` set to ``http://127.0.0.1:8787/client/v4``.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from flask import Flask, Response, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+RECORD_FIELDS = ('type', 'name', 'content', 'ttl', 'proxied', 'priority', 'comment')
+
+
+@dataclass
+class FaultConfig:
+    """
+    Latency and fault injection settings of the emulator
+
+    Attributes
+    ----------
+    latency : float = 0.0
+        Fixed delay added to every request (in seconds)
+    jitter : float = 0.0
+        Uniformly distributed extra delay added on top of the fixed latency (in seconds)
+    error_429_rate : float = 0.0
+        Probability of answering a request with 429 Too Many Requests
+    error_5xx_rate : float = 0.0
+        Probability of answering a request with a 5xx error
+    rate_limit : int = 1200
+        Requests allowed per account and window (Cloudflare's global limit), 0 disables it
+    rate_window : float = 300.0
+        Length of the rate limit window (in seconds)
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_429_rate: float = 0.0
+    error_5xx_rate: float = 0.0
+    rate_limit: int = 1200
+    rate_window: float = 300.0
+
+
+def _envelope(result, status: int = 200, errors: Optional[List[dict]] = None,
+              result_info: Optional[dict] = None, headers: Optional[dict] = None) -> Response:
+    body = {
+        'success': not errors,
+        'errors': errors or [],
+        'messages': [],
+        'result': result,
+    }
+    if result_info is not None:
+        body['result_info'] = result_info
+    return Response(json.dumps(body), status=status, headers=headers, content_type='application/json')
+
+
+def _error(status: int, code: int, message: str, headers: Optional[dict] = None) -> Response:
+    return _envelope(None, status, [{'code': code, 'message': message}], headers=headers)
+
+
+class CloudflareEmulator:
+    """
+    Cloudflare DNS records API kept in memory, zones are created on first use
+
+    Parameters
+    ----------
+    faults : FaultConfig | None
+        Latency and fault injection settings
+    seed : int | None
+        Seed of the fault injection random generator, for reproducible runs
+    """
+
+    def __init__(self, faults: Optional[FaultConfig] = None, seed: Optional[int] = None):
+        self.faults = faults or FaultConfig()
+        self.zones: Dict[str, Dict[str, dict]] = {}
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # account: [window start, requests in window]
+        self._windows: Dict[str, list] = {}
+        self.app = Flask(__name__)
+        base = '/client/v4/zones/<zone_id>/dns_records'
+        self.app.add_url_rule(base, 'list_records', self.list_records, methods=['GET'])
+        self.app.add_url_rule(base, 'create_record', self.create_record, methods=['POST'])
+        self.app.add_url_rule(f'{base}/batch', 'batch_records', self.batch_records, methods=['POST'])
+        self.app.add_url_rule(f'{base}/<rec_id>', 'get_record', self.get_record, methods=['GET'])
+        self.app.add_url_rule(f'{base}/<rec_id>', 'overwrite_record', self.overwrite_record, methods=['PUT'])
+        self.app.add_url_rule(f'{base}/<rec_id>', 'edit_record', self.edit_record, methods=['PATCH'])
+        self.app.add_url_rule(f'{base}/<rec_id>', 'delete_record', self.delete_record, methods=['DELETE'])
+        self.app.before_request(self._inject_faults)
+        self.app.after_request(self._count)
+
+    def seed_records(self, zone_id: str, records: List[dict]) -> List[dict]:
+        """
+        Insert records directly, bypassing faults and rate limits
+
+        Parameters
+        ----------
+        zone_id : str
+            Zone ID
+        records : List[dict]
+            Records with at least ``type``, ``name`` and ``content``
+
+        Returns
+        -------
+        List[dict]
+            The stored records
+        """
+        with self._lock:
+            return [self._insert(zone_id, rec) for rec in records]
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats.clear()
+            self._windows.clear()
+
+    def _insert(self, zone_id: str, values: dict, rec_id: str = '', created_on: str = '') -> dict:
+        now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        rec = {
+            'id': rec_id or uuid.uuid4().hex,
+            'zone_id': zone_id,
+            'name': values['name'],
+            'type': values['type'],
+            'content': values['content'],
+            'proxiable': values['type'] in ('A', 'AAAA', 'CNAME'),
+            'proxied': bool(values.get('proxied', False)),
+            'ttl': int(values.get('ttl', 1)),
+            'created_on': created_on or now,
+            'modified_on': now,
+        }
+        for key in ('priority', 'comment'):
+            if values.get(key) is not None:
+                rec[key] = values[key]
+        self.zones.setdefault(zone_id, {})[rec['id']] = rec
+        return rec
+
+    def _inject_faults(self) -> Response | None:
+        faults = self.faults
+        delay = faults.latency + (self._random.uniform(0, faults.jitter) if faults.jitter > 0 else 0)
+        if delay > 0:
+            time.sleep(delay)
+        if faults.rate_limit > 0:
+            account = request.headers.get('X-Auth-Email') or request.headers.get('Authorization', '')
+            now = time.monotonic()
+            with self._lock:
+                window = self._windows.setdefault(account, [now, 0])
+                if now - window[0] >= faults.rate_window:
+                    window[0], window[1] = now, 0
+                window[1] += 1
+                exceeded = window[1] > faults.rate_limit
+                retry_after = max(1, int(window[0] + faults.rate_window - now + 0.999))
+            if exceeded:
+                return _error(429, 10000, 'Rate limited. Please wait and consider throttling your request speed',
+                              headers={'Retry-After': str(retry_after)})
+        roll = self._random.random()
+        if roll < faults.error_429_rate:
+            return _error(429, 10000, 'Rate limited (injected)', headers={'Retry-After': '1'})
+        if roll < faults.error_429_rate + faults.error_5xx_rate:
+            return _error(self._random.choice((500, 502, 503)), 10001, 'Internal error (injected)')
+        return None
+
+    def _count(self, response: Response) -> Response:
+        with self._lock:
+            self.stats[f'{request.method} {response.status_code}'] += 1
+            self.stats['total'] += 1
+        return response
+
+    @staticmethod
+    def _validate(values: dict, partial: bool = False) -> Response | None:
+        if not isinstance(values, dict):
+            return _error(400, 9207, 'Request body is invalid.')
+        if not partial:
+            for key in ('type', 'name', 'content'):
+                if key not in values:
+                    return _error(400, 9000, f'DNS record {key} is required.')
+        ttl = values.get('ttl')
+        if ttl is not None and int(ttl) != 1 and not (60 <= int(ttl) <= 86400):
+            return _error(400, 9021, 'Invalid TTL. Must be between 60 and 86400 seconds, or 1 for Automatic.')
+        return None
+
+    def _conflicts(self, zone_id: str, values: dict, ignore_id: str = '') -> bool:
+        for rec in self.zones.get(zone_id, {}).values():
+            if rec['id'] != ignore_id and rec['name'] == values['name'] and rec['type'] == values['type'] \
+                    and rec['content'] == values['content']:
+                return True
+        return False
+
+    def list_records(self, zone_id: str) -> Response:
+        args = request.args
+        page = max(1, args.get('page', 1, type=int))
+        per_page = min(5000, max(5, args.get('per_page', 100, type=int)))
+        filters = {k: args[k] for k in ('name', 'type', 'content') if k in args}
+        proxied = args.get('proxied')
+        with self._lock:
+            records = [rec for rec in self.zones.get(zone_id, {}).values()
+                       if all(rec[k] == v for k, v in filters.items())
+                       and (proxied is None or rec['proxied'] == (proxied.lower() == 'true'))]
+        total = len(records)
+        chunk = records[(page - 1) * per_page:page * per_page]
+        info = {
+            'page': page,
+            'per_page': per_page,
+            'count': len(chunk),
+            'total_count': total,
+            'total_pages': (total + per_page - 1) // per_page,
+        }
+        return _envelope(chunk, result_info=info)
+
+    def create_record(self, zone_id: str) -> Response:
+        values = request.get_json(silent=True)
+        err = self._validate(values)
+        if err is not None:
+            return err
+        with self._lock:
+            if self._conflicts(zone_id, values):
+                return _error(400, 81057, 'Record already exists.')
+            rec = self._insert(zone_id, values)
+        return _envelope(rec)
+
+    def get_record(self, zone_id: str, rec_id: str) -> Response:
+        with self._lock:
+            rec = self.zones.get(zone_id, {}).get(rec_id)
+        if rec is None:
+            return _error(404, 81044, 'Record does not exist.')
+        return _envelope(rec)
+
+    def _modify(self, zone_id: str, rec_id: str, partial: bool) -> Response:
+        values = request.get_json(silent=True)
+        err = self._validate(values, partial)
+        if err is not None:
+            return err
+        with self._lock:
+            rec = self.zones.get(zone_id, {}).get(rec_id)
+            if rec is None:
+                return _error(404, 81044, 'Record does not exist.')
+            merged = dict(rec) if partial else {}
+            merged.update({k: v for k, v in values.items() if k in RECORD_FIELDS})
+            if self._conflicts(zone_id, merged, rec_id):
+                return _error(400, 81057, 'Record already exists.')
+            new_rec = self._insert(zone_id, merged, rec_id, rec['created_on'])
+        return _envelope(new_rec)
+
+    def overwrite_record(self, zone_id: str, rec_id: str) -> Response:
+        return self._modify(zone_id, rec_id, partial=False)
+
+    def edit_record(self, zone_id: str, rec_id: str) -> Response:
+        return self._modify(zone_id, rec_id, partial=True)
+
+    def delete_record(self, zone_id: str, rec_id: str) -> Response:
+        with self._lock:
+            rec = self.zones.get(zone_id, {}).pop(rec_id, None)
+        if rec is None:
+            return _error(404, 81044, 'Record does not exist.')
+        return _envelope({'id': rec_id})
+
+    def batch_records(self, zone_id: str) -> Response:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return _error(400, 9207, 'Request body is invalid.')
+        with self._lock:
+            # operations run in Cloudflare's order on a copy, the zone only changes if all of them succeed
+            original = self.zones.get(zone_id, {})
+            self.zones[zone_id] = dict(original)
+            result = {'deletes': [], 'patches': [], 'puts': [], 'posts': []}
+            try:
+                for op in body.get('deletes', []):
+                    rec = self.zones[zone_id].pop(op.get('id', ''), None)
+                    if rec is None:
+                        raise LookupError
+                    result['deletes'].append(rec)
+                for kind, partial in (('patches', True), ('puts', False)):
+                    for op in body.get(kind, []):
+                        rec = self.zones[zone_id].get(op.get('id', ''))
+                        if rec is None:
+                            raise LookupError
+                        if self._validate(op, partial) is not None:
+                            raise ValueError
+                        merged = dict(rec) if partial else {}
+                        merged.update({k: v for k, v in op.items() if k in RECORD_FIELDS})
+                        if self._conflicts(zone_id, merged, rec['id']):
+                            raise ValueError
+                        result[kind].append(self._insert(zone_id, merged, rec['id'], rec['created_on']))
+                for op in body.get('posts', []):
+                    if self._validate(op) is not None or self._conflicts(zone_id, op):
+                        raise ValueError
+                    result['posts'].append(self._insert(zone_id, op))
+            except LookupError:
+                self.zones[zone_id] = original
+                return _error(404, 81044, 'Record does not exist.')
+            except (ValueError, TypeError):
+                self.zones[zone_id] = original
+                return _error(400, 81057, 'Batch operation is invalid or conflicts with an existing record.')
+        return _envelope(result)
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs) -> None:
+        pass
+
+
+class EmulatorServer:
+    """
+    Runs a CloudflareEmulator on a background thread
+
+    Examples
+    --------
+    >>> with EmulatorServer(CloudflareEmulator()) as srv:
+    ...     dns.set_base_url(srv.base_url)
+    """
+
+    def __init__(self, emulator: CloudflareEmulator, host: str = '127.0.0.1', port: int = 0, quiet: bool = True):
+        self.emulator = emulator
+        handler = _QuietRequestHandler if quiet else None
+        self._server = make_server(host, port, emulator.app, threaded=True, request_handler=handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self._server.host}:{self._server.port}/client/v4'
+
+    def start(self) -> 'EmulatorServer':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._thread.join()
+
+    def __enter__(self) -> 'EmulatorServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Cloudflare v4 DNS records API emulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--latency', type=float, default=0.0, help='fixed delay per request (seconds)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra delay per request (seconds)')
+    parser.add_argument('--error-429', type=float, default=0.0, help='probability of an injected 429')
+    parser.add_argument('--error-5xx', type=float, default=0.0, help='probability of an injected 5xx')
+    parser.add_argument('--rate-limit', type=int, default=1200, help='requests per window, 0 disables')
+    parser.add_argument('--rate-window', type=float, default=300.0, help='rate limit window (seconds)')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    faults = FaultConfig(args.latency, args.jitter, args.error_429, args.error_5xx, args.rate_limit, args.rate_window)
+    emulator = CloudflareEmulator(faults, args.seed)
+    print(f'Cloudflare v4 emulator at http://{args.host}:{args.port}/client/v4')
+    emulator.app.run(args.host, args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
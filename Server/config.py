@@ -1,7 +1,11 @@
 import os
 import json
 
+from admission import AdmissionConfig
 from data import DnsApiConfig
+from history import HistoryConfig
+from profiling import ProfilingConfig, timed
+from replication import ReplicationConfig
 
 CFG_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
 
@@ -10,7 +14,21 @@ class Config:
     def __init__(self):
         self.dns_api = {}
         self.access_token = ''
+        self.admin_token = ''  # empty to disable the admin and replication endpoints
         self.valid_period = 120  # seconds
+        self.dns_api_url = ''  # empty for the public Cloudflare API
+        self.compact_registry = False
+        self.history = HistoryConfig()
+        # upstream DNS API budget per account (calls per second, burst) and how long a request waits for it
+        self.dns_rate = 4.0
+        self.dns_burst = 10.0
+        self.dns_write_deadline = 10.0
+        # seconds between two reconciliations of the DNS records with the registered DNS services, 0 to disable
+        self.reconcile_interval = 0
+        self.reconcile_batch_size = 100
+        self.admission = AdmissionConfig()
+        self.profiling = ProfilingConfig()
+        self.replication = ReplicationConfig()
 
     def load(self, path: str = CFG_FILE_PATH) -> bool:
         try:
@@ -22,9 +40,32 @@ class Config:
             self.access_token = raw_data['auth']['access_token']
         else:
             raise ValueError('Invalid config file, missing access token: auth.access_token')
+        if 'admin_token' in raw_data['auth']:
+            self.admin_token = raw_data['auth']['admin_token']
 
         if 'general' in raw_data and 'valid_period' in raw_data['general']:
             self.valid_period = int(raw_data['general']['valid_period'])
+        if 'general' in raw_data and 'dns_api_url' in raw_data['general']:
+            self.dns_api_url = raw_data['general']['dns_api_url']
+        if 'general' in raw_data and 'compact_registry' in raw_data['general']:
+            self.compact_registry = bool(raw_data['general']['compact_registry'])
+        if 'general' in raw_data and 'history' in raw_data['general']:
+            self.history = HistoryConfig(**raw_data['general']['history'])
+        if 'general' in raw_data and 'dns_rate_limit' in raw_data['general']:
+            rate_limit = raw_data['general']['dns_rate_limit']
+            self.dns_rate = float(rate_limit.get('rate', self.dns_rate))
+            self.dns_burst = float(rate_limit.get('burst', self.dns_burst))
+            self.dns_write_deadline = float(rate_limit.get('deadline', self.dns_write_deadline))
+        if 'general' in raw_data and 'reconcile' in raw_data['general']:
+            reconcile = raw_data['general']['reconcile']
+            self.reconcile_interval = float(reconcile.get('interval', self.reconcile_interval))
+            self.reconcile_batch_size = int(reconcile.get('batch_size', self.reconcile_batch_size))
+        if 'general' in raw_data and 'admission' in raw_data['general']:
+            self.admission = AdmissionConfig(**raw_data['general']['admission'])
+        if 'general' in raw_data and 'profiling' in raw_data['general']:
+            self.profiling = ProfilingConfig(**raw_data['general']['profiling'])
+        if 'general' in raw_data and 'replication' in raw_data['general']:
+            self.replication = ReplicationConfig(**raw_data['general']['replication'])
 
         at_least_one = False
         if 'dns' in raw_data:
@@ -35,9 +76,14 @@ class Config:
 
         return at_least_one
 
+    @timed('auth')
     def evaluate_access_token(self, token: str) -> bool:
         return token == self.access_token
 
+    @timed('auth')
+    def evaluate_admin_token(self, token: str) -> bool:
+        return bool(self.admin_token) and token == self.admin_token
+
     def has_dns_api(self, domain: str) -> bool:
         for dom in self.dns_api.keys():
             if domain.endswith(dom):
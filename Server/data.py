@@ -1,5 +1,9 @@
-from enum import Enum
+import hashlib
+import json
+import sys
+from array import array
 from dataclasses import dataclass
+from enum import Enum
 
 
 @dataclass
@@ -54,8 +58,86 @@ class ServiceType(str, Enum):
     ROBOT = 'robot'
 
 
-@dataclass
-class Service:
+# bytes of the digest of service_fingerprint
+FINGERPRINT_SIZE = 16
+
+
+def service_fingerprint(description: str, data: dict | None) -> str:
+    """
+    Stable content hash of a service's description and data, must match the client's implementation
+
+    Parameters
+    ----------
+    description : str
+        Service description
+    data : dict | None
+        Service data
+
+    Returns
+    -------
+    str
+        Hex digest
+    """
+    canonical = json.dumps([description, data], sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=FINGERPRINT_SIZE).hexdigest()
+
+
+class JsonText(str):
+    """
+    Service data kept as compact JSON text by the compact registry, decoded on access
+
+    Plain str data supplied by users is never decoded, only values wrapped in this marker are.
+    """
+
+    __slots__ = ()
+
+
+class _ServiceFields:
+    # fields shared by Service and ColumnarService, data of compact services is kept as JsonText until accessed,
+    # metrics are the resource samples of the last heartbeat and are not persisted
+    __slots__ = ('name', 'description', '_data', '_fingerprint', 'address', 'metrics')
+
+    def __init__(self, name: str, description: str, data: dict | JsonText | None, fingerprint: str, address: str):
+        self.name = sys.intern(name)
+        self.description = sys.intern(description)
+        self._data = data
+        self._fingerprint = fingerprint
+        self.address = address
+        self.metrics = None
+
+    @property
+    def data(self) -> dict | None:
+        data = self._data
+        if data.__class__ is JsonText:
+            return json.loads(data)
+        return data
+
+    @data.setter
+    def data(self, value: dict | None):
+        self._data = value
+        self._fingerprint = ''
+
+    @property
+    def fingerprint(self) -> str:
+        if not self._fingerprint:
+            self._fingerprint = service_fingerprint(self.description, self.data)
+        return self._fingerprint
+
+    def _astuple(self) -> tuple:
+        return self.name, self.type, self.description, self.create_time, self.valid, self.valid_until, self.data
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, _ServiceFields):
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(name={self.name!r}, type={self.type!r}, description={self.description!r}, '
+                f'create_time={self.create_time!r}, valid={self.valid!r}, valid_until={self.valid_until!r}, '
+                f'data={self.data!r})')
+
+
+class Service(_ServiceFields):
     """
     Service configuration
 
@@ -75,12 +157,140 @@ class Service:
         Service valid until
     data : dict = None
         Service data, note that the data should be JSON serializable
+    fingerprint : str = ''
+        Content hash of description and data (see service_fingerprint), computed on first access if empty
+    address : str = ''
+        Last address reported by the agent of a DNS service, the desired content of its record
     """
 
-    name: str
-    type: ServiceType
-    description: str = ''
-    create_time: int = 0
-    valid: bool = True
-    valid_until: int = 0
-    data: dict = None
+    __slots__ = ('type', 'create_time', 'valid', 'valid_until')
+
+    def __init__(self, name: str, type: ServiceType, description: str = '', create_time: int = 0, valid: bool = True,
+                 valid_until: int = 0, data: dict | None = None, fingerprint: str = '', address: str = ''):
+        super().__init__(name, description, data, fingerprint, address)
+        self.type = type
+        self.create_time = create_time
+        self.valid = valid
+        self.valid_until = valid_until
+
+
+SERVICE_TYPES = tuple(ServiceType)
+SERVICE_TYPE_CODES = {t: i for i, t in enumerate(SERVICE_TYPES)}
+
+
+class ServiceColumns:
+    """
+    Array-backed storage of the hot scalar fields of ColumnarService, indexed by slot id
+
+    Attributes
+    ----------
+    type_code : array
+        Index of the service type in SERVICE_TYPES
+    create_time : array
+        Service creation time
+    valid : array
+        Whether the service is valid
+    valid_until : array
+        Service valid until
+    fingerprint : bytearray
+        Fingerprint digests, FINGERPRINT_SIZE bytes per slot
+    """
+
+    def __init__(self):
+        self.type_code = array('B')
+        self.create_time = array('q')
+        self.valid = array('b')
+        self.valid_until = array('q')
+        self.fingerprint = bytearray()
+        self._free = []
+
+    def __len__(self) -> int:
+        return len(self.valid) - len(self._free)
+
+    def allocate(self, service_type: ServiceType, create_time: int, valid: bool, valid_until: int,
+                 fingerprint: bytes) -> int:
+        if self._free:
+            slot = self._free.pop()
+            self.type_code[slot] = SERVICE_TYPE_CODES[service_type]
+            self.create_time[slot] = create_time
+            self.valid[slot] = valid
+            self.valid_until[slot] = valid_until
+            self.set_fingerprint(slot, fingerprint)
+            return slot
+        self.type_code.append(SERVICE_TYPE_CODES[service_type])
+        self.create_time.append(create_time)
+        self.valid.append(valid)
+        self.valid_until.append(valid_until)
+        self.fingerprint += fingerprint
+        return len(self.valid) - 1
+
+    def get_fingerprint(self, slot: int) -> str:
+        return self.fingerprint[slot * FINGERPRINT_SIZE:(slot + 1) * FINGERPRINT_SIZE].hex()
+
+    def set_fingerprint(self, slot: int, fingerprint: bytes) -> None:
+        self.fingerprint[slot * FINGERPRINT_SIZE:(slot + 1) * FINGERPRINT_SIZE] = fingerprint
+
+    def release(self, slot: int) -> None:
+        self._free.append(slot)
+
+
+def _column_property(column: str, decode: callable = None, encode: callable = None) -> property:
+    def getter(self):
+        value = getattr(self._columns, column)[self._slot]
+        return decode(value) if decode is not None else value
+
+    def setter(self, value):
+        getattr(self._columns, column)[self._slot] = encode(value) if encode is not None else value
+
+    return property(getter, setter)
+
+
+def _fingerprint_digest(fingerprint: str) -> bytes | None:
+    try:
+        digest = bytes.fromhex(fingerprint)
+    except ValueError:
+        return None
+    return digest if len(digest) == FINGERPRINT_SIZE else None
+
+
+class ColumnarService(_ServiceFields):
+    """
+    Service whose scalar fields and fingerprint live in a shared ServiceColumns, same attributes as Service
+
+    Attributes
+    ----------
+    slot : int
+        Slot id of the service in its ServiceColumns, released by the owner when the service is discarded
+    """
+
+    __slots__ = ('_columns', '_slot')
+
+    def __init__(self, columns: ServiceColumns, name: str, type: ServiceType, description: str = '',
+                 create_time: int = 0, valid: bool = True, valid_until: int = 0, data: dict | JsonText | None = None,
+                 fingerprint: str = '', address: str = ''):
+        super().__init__(name, description, data, '', address)
+        digest = _fingerprint_digest(fingerprint) or bytes.fromhex(service_fingerprint(self.description, self.data))
+        self._columns = columns
+        self._slot = columns.allocate(type, create_time, valid, valid_until, digest)
+
+    @property
+    def slot(self) -> int:
+        return self._slot
+
+    @property
+    def data(self) -> dict | None:
+        return _ServiceFields.data.fget(self)
+
+    @data.setter
+    def data(self, value: dict | None):
+        self._data = value
+        self._columns.set_fingerprint(self._slot, bytes.fromhex(service_fingerprint(self.description, value)))
+
+    @property
+    def fingerprint(self) -> str:
+        return self._columns.get_fingerprint(self._slot)
+
+    type = _column_property('type_code', SERVICE_TYPES.__getitem__, SERVICE_TYPE_CODES.__getitem__)
+    create_time = _column_property('create_time')
+    valid = _column_property('valid', bool)
+    valid_until = _column_property('valid_until')
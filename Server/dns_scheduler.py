@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import requests
+
+from cloudflare_v4_api import dns
+from utils import TokenBucket
+
+
+@dataclass
+class DnsWrite:
+    """
+    A pending add-or-update of a DNS record
+
+    Attributes
+    ----------
+    zone_id : str
+        Zone ID
+    email : str
+        Email of the account
+    api_key : str
+        API key
+    rec_type : str
+        Record type
+    name : str
+        Record name
+    content : str
+        Record content
+    ttl : int | None
+        TTL
+    priority : int | None
+        Priority
+    proxied : bool
+        Whether the record is proxied
+    """
+
+    zone_id: str
+    email: str
+    api_key: str
+    rec_type: str
+    name: str
+    content: str
+    ttl: int | None = None
+    priority: int | None = None
+    proxied: bool = False
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return self.zone_id, self.name, self.rec_type
+
+
+class WriteTicket:
+    """
+    Handle on a submitted write, completed when the write (or a newer one for the same record) is applied
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.operation = ''
+        self.result: dict | None = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout)
+
+    def complete(self, operation: str, result: dict | None) -> None:
+        self.operation = operation
+        self.result = result
+        self._done.set()
+
+
+class _AccountQueue:
+    # pending writes of one account, drained by a dedicated thread at the rate of the account's bucket
+    def __init__(self, bucket: TokenBucket, max_attempts: int):
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        # (zone, name, type): [write, tickets, attempts, not before]
+        self.pending: OrderedDict[Tuple[str, str, str], list] = OrderedDict()
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, write: DnsWrite, ticket: WriteTicket) -> None:
+        with self.cond:
+            entry = self.pending.get(write.key)
+            if entry is None:
+                self.pending[write.key] = [write, [ticket], 0, 0.0]
+            else:
+                # last write wins, everyone waiting on the record gets its result
+                entry[0] = write
+                entry[1].append(ticket)
+                entry[2], entry[3] = 0, 0.0
+            self.cond.notify()
+
+    def _next(self) -> Tuple[Tuple[str, str, str], list]:
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                ready = [k for k, v in self.pending.items() if v[3] <= now]
+                if ready:
+                    return ready[0], self.pending[ready[0]]
+                delays = [v[3] - now for v in self.pending.values()]
+                self.cond.wait(min(delays) if delays else None)
+
+    def _apply(self, write: DnsWrite) -> Tuple[str, dict | None]:
+        # one call to find the record and one to write it
+        self.bucket.acquire(2)
+        try:
+            records = dns.get_all_dns_record(write.zone_id, write.email, write.api_key,
+                                             name=write.name, rec_type=write.rec_type)
+            if records is None:
+                return '', None
+            if records:
+                return 'update', dns.update_dns_record(write.zone_id, write.email, write.api_key, records[0]['id'],
+                                                       write.rec_type, write.name, write.content, write.ttl,
+                                                       write.proxied)
+            return 'add', dns.create_dns_record(write.zone_id, write.email, write.api_key, write.rec_type,
+                                                write.name, write.content, write.ttl, write.priority, write.proxied)
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            return '', None
+
+    def _run(self) -> None:
+        while True:
+            key, entry = self._next()
+            write = entry[0]
+            operation, result = self._apply(write)
+            with self.cond:
+                if entry[0] is not write:
+                    # superseded while in flight, the newer write stays queued
+                    continue
+                entry[2] += 1
+                if result is None and entry[2] < self.max_attempts:
+                    entry[3] = time.monotonic() + 2 ** entry[2]
+                    continue
+                del self.pending[key]
+                tickets = entry[1]
+            for ticket in tickets:
+                ticket.complete(operation, result)
+
+
+class DnsWriteScheduler:
+    """
+    Queues DNS record writes per account and applies them at the rate the provider allows
+
+    Writes to the same (zone, name, type) are coalesced, only the last one is sent. Failed writes are retried
+    with exponential backoff.
+
+    Parameters
+    ----------
+    rate : float = 4
+        Sustained API calls per second and account (Cloudflare allows 1200 per 5 minutes)
+    burst : float = 10
+        API calls an idle account may make at once
+    max_attempts : int = 3
+        Attempts per write before its tickets complete with a None result
+    """
+
+    def __init__(self, rate: float = 4, burst: float = 10, max_attempts: int = 3):
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self._queues: Dict[Tuple[str, str], _AccountQueue] = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, email: str, api_key: str) -> _AccountQueue:
+        with self._lock:
+            queue = self._queues.get((email, api_key))
+            if queue is None:
+                queue = self._queues[(email, api_key)] = _AccountQueue(TokenBucket(self.rate, self.burst),
+                                                                       self.max_attempts)
+            return queue
+
+    def bucket(self, email: str, api_key: str) -> TokenBucket:
+        """
+        Token bucket of an account, for calls made outside the queue (reads, deletes)
+        """
+        return self._queue(email, api_key).bucket
+
+    def submit(self, write: DnsWrite) -> WriteTicket:
+        ticket = WriteTicket()
+        self._queue(write.email, write.api_key).submit(write, ticket)
+        return ticket
+
+    def pending(self) -> List[Tuple[str, str, str]]:
+        with self._lock:
+            queues = list(self._queues.values())
+        keys = []
+        for queue in queues:
+            with queue.cond:
+                keys.extend(queue.pending.keys())
+        return keys
@@ -0,0 +1,314 @@
+import base64
+import os
+import threading
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List
+
+import serialization
+
+HISTORY_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history_store.json')
+
+
+@dataclass
+class HistoryConfig:
+    """
+    Size of the per-service history, memory use per service is fixed by these values
+
+    Attributes
+    ----------
+    transitions : int = 64
+        Number of state transitions kept
+    bucket_seconds : int = 900
+        Length of the fine time buckets (in seconds)
+    buckets : int = 96
+        Number of fine time buckets (24 h by default)
+    coarse_bucket_seconds : int = 21600
+        Length of the coarse time buckets the fine ones are downsampled into (in seconds)
+    coarse_buckets : int = 120
+        Number of coarse time buckets (30 days by default)
+    save_interval : int = 300
+        Minimum time between two saves of the history store triggered by heartbeats (in seconds)
+    """
+
+    transitions: int = 64
+    bucket_seconds: int = 900
+    buckets: int = 96
+    coarse_bucket_seconds: int = 21600
+    coarse_buckets: int = 120
+    save_interval: int = 300
+
+
+def _pack(arr: array) -> str:
+    return base64.b64encode(arr.tobytes()).decode('ascii')
+
+
+def _unpack(typecode: str, raw: str, length: int) -> array:
+    arr = array(typecode)
+    arr.frombytes(base64.b64decode(raw))
+    if len(arr) != length:
+        # the store was written with another size, start over
+        return array(typecode, bytes(arr.itemsize * length))
+    return arr
+
+
+class BucketRing:
+    """
+    Heartbeat counters aggregated in fixed-size time buckets, the oldest bucket is reused as time advances
+
+    Parameters
+    ----------
+    seconds : int
+        Length of a bucket (in seconds)
+    count : int
+        Number of buckets
+    """
+
+    FIELDS = (('up', 'H'), ('total', 'H'), ('latency_count', 'H'), ('latency_sum', 'f'), ('latency_max', 'f'))
+
+    def __init__(self, seconds: int, count: int):
+        self.seconds = seconds
+        self.count = count
+        # id (start time // seconds) of the newest bucket
+        self.last_id = 0
+        for field, typecode in self.FIELDS:
+            setattr(self, field, array(typecode, bytes(array(typecode).itemsize * count)))
+
+    def _advance(self, bucket_id: int) -> None:
+        if bucket_id <= self.last_id:
+            return
+        for i in range(max(self.last_id + 1, bucket_id - self.count + 1), bucket_id + 1):
+            idx = i % self.count
+            for field, _ in self.FIELDS:
+                getattr(self, field)[idx] = 0
+        self.last_id = bucket_id
+
+    def add(self, t: float, valid: bool, latency: float | None = None) -> None:
+        bucket_id = int(t // self.seconds)
+        if bucket_id <= self.last_id - self.count:
+            return
+        self._advance(bucket_id)
+        idx = bucket_id % self.count
+        if self.total[idx] == 0xFFFF:
+            return
+        self.total[idx] += 1
+        self.up[idx] += bool(valid)
+        if latency is not None:
+            self.latency_count[idx] += 1
+            self.latency_sum[idx] += latency
+            self.latency_max[idx] = max(self.latency_max[idx], latency)
+
+    def report(self, since: float) -> List[dict]:
+        result = []
+        first = max(int(since // self.seconds), self.last_id - self.count + 1)
+        for bucket_id in range(first, self.last_id + 1):
+            idx = bucket_id % self.count
+            if self.total[idx] == 0:
+                continue
+            n = self.latency_count[idx]
+            result.append({
+                'start': bucket_id * self.seconds,
+                'up': self.up[idx],
+                'total': self.total[idx],
+                'latency_avg': round(self.latency_sum[idx] / n, 4) if n else None,
+                'latency_max': round(self.latency_max[idx], 4) if n else None,
+            })
+        return result
+
+    def to_dict(self) -> dict:
+        d = {'last_id': self.last_id}
+        for field, _ in self.FIELDS:
+            d[field] = _pack(getattr(self, field))
+        return d
+
+    def load_dict(self, d: dict) -> None:
+        self.last_id = d['last_id']
+        for field, typecode in self.FIELDS:
+            setattr(self, field, _unpack(typecode, d[field], self.count))
+
+
+class ServiceHistory:
+    """
+    State transitions and heartbeat latencies of one service, in fixed-size array-backed rings
+
+    Parameters
+    ----------
+    config : HistoryConfig
+        Ring sizes
+    """
+
+    def __init__(self, config: HistoryConfig):
+        self.capacity = config.transitions
+        self.transition_time = array('q', bytes(8 * self.capacity))
+        self.transition_state = array('b', bytes(self.capacity))
+        # index of the next write and number of valid transitions
+        self.head = 0
+        self.size = 0
+        self.last_seen = 0
+        self.fine = BucketRing(config.bucket_seconds, config.buckets)
+        self.coarse = BucketRing(config.coarse_bucket_seconds, config.coarse_buckets)
+
+    @property
+    def state(self) -> bool | None:
+        if self.size == 0:
+            return None
+        return bool(self.transition_state[(self.head - 1) % self.capacity])
+
+    def record(self, t: float, valid: bool, latency: float | None = None) -> None:
+        if self.state is not bool(valid):
+            self.transition_time[self.head] = int(t)
+            self.transition_state[self.head] = bool(valid)
+            self.head = (self.head + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+        self.last_seen = int(t)
+        self.fine.add(t, valid, latency)
+        self.coarse.add(t, valid, latency)
+
+    def transitions(self, since: float = 0) -> List[List[int]]:
+        result = []
+        for i in range(self.size):
+            idx = (self.head - self.size + i) % self.capacity
+            if self.transition_time[idx] >= since:
+                result.append([self.transition_time[idx], self.transition_state[idx]])
+        return result
+
+    def uptime(self, since: float, now: float, grace: float) -> float | None:
+        """
+        Percentage of time the service was up over a window
+
+        Time before the oldest kept transition is not counted, time after the last heartbeat plus ``grace``
+        counts as down.
+
+        Parameters
+        ----------
+        since : float
+            Start of the window
+        now : float
+            End of the window
+        grace : float
+            How long a heartbeat keeps the service in its reported state (usually the valid period)
+
+        Returns
+        -------
+        float | None
+            Uptime in percent, None if nothing is known about the window
+        """
+        known = up = 0.0
+        points = self.transitions()
+        if not points:
+            return None
+        # the service is assumed down once heartbeats stop
+        points.append([max(self.last_seen + grace, points[-1][0]), 0])
+        for i, (t, state) in enumerate(points):
+            end = points[i + 1][0] if i + 1 < len(points) else now
+            start, end = max(t, since), min(end, now)
+            if end > start:
+                known += end - start
+                up += (end - start) if state else 0
+        if known == 0:
+            return None
+        return round(100 * up / known, 3)
+
+    def buckets(self, since: float) -> List[dict]:
+        # fine buckets when they cover the window, the downsampled coarse ones otherwise
+        fine_start = (self.fine.last_id - self.fine.count + 1) * self.fine.seconds
+        ring = self.fine if since >= fine_start else self.coarse
+        return ring.report(since)
+
+    def to_dict(self) -> dict:
+        return {
+            'transitions': [_pack(self.transition_time), _pack(self.transition_state), self.head, self.size],
+            'last_seen': self.last_seen,
+            'fine': self.fine.to_dict(),
+            'coarse': self.coarse.to_dict(),
+        }
+
+    def load_dict(self, d: dict) -> None:
+        time_raw, state_raw, head, size = d['transitions']
+        self.transition_time = _unpack('q', time_raw, self.capacity)
+        self.transition_state = _unpack('b', state_raw, self.capacity)
+        if len(base64.b64decode(time_raw)) == 8 * self.capacity:
+            self.head, self.size = head, size
+        self.last_seen = d['last_seen']
+        self.fine.load_dict(d['fine'])
+        self.coarse.load_dict(d['coarse'])
+
+
+class HistoryStore:
+    """
+    Histories of all services
+
+    Parameters
+    ----------
+    config : HistoryConfig | None
+        Ring sizes, defaults if None
+    """
+
+    def __init__(self, config: HistoryConfig | None = None):
+        self.config = config or HistoryConfig()
+        # name(str): ServiceHistory
+        self.histories: Dict[str, ServiceHistory] = {}
+        self.last_save = 0.0
+        # claims of saves and writes of the file, heartbeats of several request threads may trigger a save
+        self._claim_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def record(self, name: str, t: float, valid: bool, latency: float | None = None) -> None:
+        history = self.histories.get(name)
+        if history is None:
+            history = self.histories[name] = ServiceHistory(self.config)
+        history.record(t, valid, latency)
+
+    def get(self, name: str) -> ServiceHistory | None:
+        return self.histories.get(name)
+
+    def discard(self, name: str) -> None:
+        self.histories.pop(name, None)
+
+    def to_dict(self) -> dict:
+        # copied first, request threads add histories while a save is running
+        return {name: h.to_dict() for name, h in list(self.histories.items())}
+
+    def load_dict(self, raw_data: dict) -> None:
+        for name, d in raw_data.items():
+            history = ServiceHistory(self.config)
+            history.load_dict(d)
+            self.histories[name] = history
+
+    def load(self, path: str = HISTORY_STORE_PATH) -> bool:
+        try:
+            with open(path, 'rb') as f:
+                raw_data = serialization.loads(f.read())
+        except FileNotFoundError:
+            return False
+        self.load_dict(raw_data)
+        return True
+
+    def save(self, path: str = HISTORY_STORE_PATH, now: float = 0) -> None:
+        with self._claim_lock:
+            self.last_save = max(self.last_save, now)
+        with self._save_lock:
+            tmp = f'{path}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(serialization.dumps(self.to_dict()))
+            os.replace(tmp, path)
+
+    def claim_save(self, now: float) -> bool:
+        """
+        Whether a save is due, a caller getting True is the only one until ``save_interval`` passed again
+
+        Parameters
+        ----------
+        now : float
+            Current time
+
+        Returns
+        -------
+        bool
+            True if the caller should save the store
+        """
+        with self._claim_lock:
+            if now - self.last_save < self.config.save_interval:
+                return False
+            self.last_save = now
+            return True
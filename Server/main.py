@@ -1,49 +1,146 @@
-import datetime
-import json
+import argparse
+import atexit
+import math
 import time
 from typing import List
 
-from flask import Flask, Response, request
+import requests
+from flask import Flask, Response, abort, g, request
 
 from data import *
-from config import Config
-from service import RegisteredServices
+from admission import AdmissionControl
+from profiling import RequestProfiler, phase
+from config import Config, CFG_FILE_PATH
+from history import HISTORY_STORE_PATH
+from service import RegisteredServices, SNAPSHOT_PATH
+from replication import Replica, ReplicationLog, encode_put
+from dns_scheduler import DnsWrite, DnsWriteScheduler
+from reconciler import DnsReconciler
+import serialization
 
 from cloudflare_v4_api import dns
 
 
 class EndPointAction:
-    def __init__(self, action: callable):
+    def __init__(self, action: callable, admission: AdmissionControl | None = None, client_key: callable = None,
+                 profiler: RequestProfiler | None = None):
         self.action = action
+        self.admission = admission
+        self.client_key = client_key
+        self.profiler = profiler
+
+    def _handle(self, *args, **kwargs) -> Response:
+        if self.profiler is None:
+            return self.action(*args, **kwargs)
+        return self.profiler.run(f'{request.method} {request.path}', self.action, *args, **kwargs)
 
     def __call__(self, *args, **kwargs) -> Response:
-        response = self.action(*args, **kwargs)
+        if self.admission is None:
+            return self._handle(*args, **kwargs)
+        status, retry_after = self.admission.enter(self.client_key())
+        if status:
+            message = 'Too many requests' if status == AdmissionControl.RATE_LIMITED else 'Server overloaded'
+            return Response(message, status=status, headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+        try:
+            response = self._handle(*args, **kwargs)
+        finally:
+            self.admission.leave()
         return response
 
 
 class FlaskAppWrapper:
-    def __init__(self, name: str):
+    def __init__(self, name: str, admission: AdmissionControl | None = None, client_key: callable = None,
+                 profiler: RequestProfiler | None = None):
         self.app = Flask(name)
+        self.admission = admission
+        self.client_key = client_key
+        self.profiler = profiler
 
-    def run(self):
-        self.app.run()
+    def run(self, host: str | None = None, port: int | None = None):
+        self.app.run(host, port)
 
-    def add_endpoint(self, endpoint: str, endpoint_name, handler: callable, method: List[str]) -> None:
-        self.app.add_url_rule(endpoint, endpoint_name, EndPointAction(handler), methods=method)
+    def add_endpoint(self, endpoint: str, endpoint_name, handler: callable, method: List[str],
+                     limited: bool = True) -> None:
+        # limited=False bypasses admission control, for long polling between servers
+        action = EndPointAction(handler, self.admission if limited else None, self.client_key, self.profiler)
+        self.app.add_url_rule(endpoint, endpoint_name, action, methods=method)
 
 
 class Server:
-    def __init__(self, name: str, config: Config, registered_services: RegisteredServices):
+    def __init__(self, name: str, config: Config, registered_services: RegisteredServices,
+                 started: float | None = None):
         self.config = config
         self.registered_services = registered_services
-        self.app = FlaskAppWrapper(name)
-        self.app.add_endpoint('/api/srv/reg', 'register_service', self.register_service, ['POST'])
-        self.app.add_endpoint('/api/srv/renew', 'renew_service', self.renew_service, ['POST'])
-        self.app.add_endpoint('/api/dns/get', 'get_dns_record', self.get_dns_record, ['GET', 'POST'])
-        self.app.add_endpoint('/api/dns/add', 'add_(or_update)_dns_record', self.add_or_update_dns_record, ['POST'])
-        self.app.add_endpoint('/api/dns/update', '(add_or_)update_dns_record', self.add_or_update_dns_record, ['POST'])
-        self.app.add_endpoint('/api/dns/delete', 'delete_dns_record', self.delete_dns_record, ['GET', 'POST'])
+        # monotonic time the process started, to report the time to the first request
+        self.started = time.monotonic() if started is None else started
+        self.first_request = 0.0
+        self.dns_scheduler = DnsWriteScheduler(config.dns_rate, config.dns_burst)
+        self.reconciler = DnsReconciler(config, registered_services, self.dns_scheduler,
+                                        config.reconcile_interval, config.reconcile_batch_size)
+        self.replica = None
+        if config.replication.role == 'replica':
+            # replicas only serve reads, DNS is left to the primary
+            if not config.admin_token:
+                print('Replicas authenticate with the admin token of the primary, auth.admin_token is empty')
+            self.replica = Replica(config.replication, registered_services, config.admin_token)
+            self.replica.start()
+        elif config.reconcile_interval > 0:
+            self.reconciler.start()
+        if config.replication.role == 'primary':
+            registered_services.log = ReplicationLog(config.replication.log_size)
+        self.admission = AdmissionControl(config.admission)
+        self.profiler = RequestProfiler(config.profiling)
+        self.app = FlaskAppWrapper(name, self.admission, self._client_key, self.profiler)
+        write = self._write_handler
+        self.app.add_endpoint('/api/srv/reg', 'register_service', write(self.register_service), ['POST'])
+        self.app.add_endpoint('/api/srv/renew', 'renew_service', write(self.renew_service), ['POST'])
+        self.app.add_endpoint('/api/srv/unreg', 'unregister_service', write(self.unregister_service), ['POST'])
+        self.app.add_endpoint('/api/srv/history', 'service_history', self.get_service_history, ['GET', 'POST'])
+        self.app.add_endpoint('/api/dns/get', 'get_dns_record', write(self.get_dns_record), ['GET', 'POST'])
+        self.app.add_endpoint('/api/dns/add', 'add_(or_update)_dns_record', write(self.add_or_update_dns_record), ['POST'])
+        self.app.add_endpoint('/api/dns/update', '(add_or_)update_dns_record', write(self.add_or_update_dns_record), ['POST'])
+        self.app.add_endpoint('/api/dns/delete', 'delete_dns_record', write(self.delete_dns_record), ['GET', 'POST'])
+        # admin and replication endpoints only exist with an admin token, the agents' token is not enough
+        if config.admin_token:
+            self.app.add_endpoint('/api/admin/profiling', 'profiling', self.profiling, ['GET', 'POST'])
+            if registered_services.log is not None:
+                self.app.add_endpoint('/api/repl/log', 'replication_log', self.replication_log, ['GET'],
+                                      limited=False)
+                self.app.add_endpoint('/api/repl/snapshot', 'replication_snapshot', self.replication_snapshot,
+                                      ['GET'], limited=False)
+        elif registered_services.log is not None:
+            print('Replication disabled, auth.admin_token is empty')
         self.app.add_endpoint('/', 'show_service_status', self.get_service_status, ['GET', 'POST'])
+        self.app.app.before_request(self._report_first_request)
+
+    def _write_handler(self, handler: callable) -> callable:
+        # on replicas, requests that change state (or call the DNS API) are handled by the primary
+        return handler if self.replica is None else self._forward_write
+
+    def _forward_write(self) -> Response:
+        replication = self.config.replication
+        if not replication.forward_writes:
+            return Response(f'Read only replica, the primary is {replication.primary_url}', status=421)
+        headers = {k: v for k, v in request.headers.items() if k in ('Content-Type', 'Accept')}
+        # the primary budgets the agent behind this replica by its own address, see _client_key
+        headers['X-Forwarded-For'] = self._client_address()
+        headers['X-Admin-Token'] = self.replica.token
+        try:
+            with phase('upstream'):
+                resp = requests.request(request.method, f'{replication.primary_url}{request.path}',
+                                        params=request.args, data=request.get_data(), headers=headers, timeout=30)
+        except requests.exceptions.RequestException:
+            return Response('Primary unreachable', status=502)
+        headers = {'Retry-After': resp.headers['Retry-After']} if 'Retry-After' in resp.headers else None
+        return Response(resp.content, status=resp.status_code, headers=headers,
+                        content_type=resp.headers.get('Content-Type'))
+
+    def _report_first_request(self) -> None:
+        if self.first_request:
+            return
+        self.first_request = time.monotonic() - self.started
+        print(f'First request {self.first_request:.3f} s after start, store '
+              f'{"loaded" if self.registered_services.loaded.is_set() else "still loading"}')
 
     def _register_service(self, name: str, service_type: ServiceType, description: str, valid: bool, data: dict) -> Response:
         valid_until = int(time.time() + self.config.valid_period)
@@ -61,11 +158,47 @@ class Server:
             self.registered_services.register_service(name, srv)
             return Response('Service registered', status=200)
 
-    def _auth_get_dom(self):
+    @staticmethod
+    def _request_values():
+        # decoded once per request, admission control needs the token before the handler runs
+        if 'values' in g:
+            return g.values
         if request.method == 'GET':
-            values = request.args
-        else:
-            values = request.get_json()
+            g.values = request.args
+            return g.values
+        try:
+            g.values = serialization.decode_body(request.content_type or '', request.get_data())
+        except serialization.UnsupportedMediaType:
+            abort(415)
+        except ValueError:
+            abort(400)
+        return g.values
+
+    def _client_key(self) -> str:
+        # every client is budgeted by its address, agents share the access token so it cannot tell them apart
+        forwarded = request.headers.get('X-Forwarded-For')
+        if forwarded and self.config.evaluate_admin_token(request.headers.get('X-Admin-Token', 'none')):
+            # a write forwarded by a replica, only trusted with the admin token the replica authenticates with
+            return forwarded.rsplit(',', 1)[-1].strip()
+        return self._client_address()
+
+    def _client_address(self) -> str:
+        address = request.remote_addr or ''
+        if address in self.config.admission.trusted_proxies:
+            # the address a trusted reverse proxy appended last is the one it received the request from
+            forwarded = request.headers.get('X-Forwarded-For')
+            if forwarded:
+                return forwarded.rsplit(',', 1)[-1].strip()
+        return address
+
+    @staticmethod
+    def _data_response(obj, status: int = 200) -> Response:
+        # JSON unless the client accepts one of the compact formats (MessagePack, CBOR)
+        mime = request.accept_mimetypes.best_match(serialization.CODECS, serialization.MIME_JSON)
+        return Response(serialization.encode_body(obj, mime), status=status, content_type=mime)
+
+    def _auth_get_dom(self):
+        values = self._request_values()
         token = values.get('token', 'none')
         if not self.config.evaluate_access_token(token):
             return Response('Unauthorized', status=401)
@@ -74,20 +207,42 @@ class Server:
             return Response('Domain Zone not found', status=404)
         return domain, values
 
+    def _heartbeat(self, name: str, valid: bool, values) -> None:
+        # optional heartbeat fields: resource samples, the agent's address (DNS services) and check latency
+        srv = self.registered_services.get_service(name)
+        if 'metrics' in values:
+            srv.metrics = values['metrics']
+        if values.get('address'):
+            self.registered_services.set_address(name, values['address'])
+        self.registered_services.touched(name)
+        self.registered_services.record_heartbeat(name, valid, values.get('latency'))
+
     def register_service(self) -> Response:
-        values = request.get_json()
+        values = self._request_values()
         token = values.get('token', 'none')
         if not self.config.evaluate_access_token(token):
             return Response('Unauthorized', status=401)
         name = values['name']
         service_type = ServiceType(values['type'])
         valid = bool(values['valid'])
+        if 'fingerprint' in values and 'description' not in values and 'data' not in values:
+            # fingerprint only registration, the full payload is only needed when the content changed
+            if self.registered_services.same_fingerprint(name, service_type, values['fingerprint']):
+                srv = self.registered_services.get_service(name)
+                srv.valid_until = int(time.time() + self.config.valid_period)
+                self._heartbeat(name, valid, values)
+                return Response('Service already registered', status=200)
+            return Response('Service payload required', status=409)
         description = values.get('description', '')
         data = values.get('data', {})
-        return self._register_service(name, service_type, description, valid, data)
+        if data is not None and not isinstance(data, dict):
+            return Response('Service data must be an object or null', status=400)
+        resp = self._register_service(name, service_type, description, valid, data)
+        self._heartbeat(name, valid, values)
+        return resp
 
     def renew_service(self) -> Response:
-        values = request.get_json()
+        values = self._request_values()
         token = values.get('token', 'none')
         if not self.config.evaluate_access_token(token):
             return Response('Unauthorized', status=401)
@@ -100,22 +255,57 @@ class Server:
         if valid:
             srv.valid_until = int(time.time() + self.config.valid_period)
         srv.valid = valid
+        self._heartbeat(name, valid, values)
         return Response('Service renewed', status=200)
 
+    def get_service_history(self) -> Response:
+        values = self._request_values()
+        token = values.get('token', 'none')
+        if not self.config.evaluate_access_token(token):
+            return Response('Unauthorized', status=401)
+        name = values.get('name', None)
+        if name is not None and self.registered_services.get_service(name) is None:
+            return Response('Service not registered', status=404)
+        window = float(values.get('window', 86400))
+        return self._data_response(self.registered_services.history_report(name, window, self.config.valid_period))
+
+    def unregister_service(self) -> Response:
+        values = self._request_values()
+        token = values.get('token', 'none')
+        if not self.config.evaluate_access_token(token):
+            return Response('Unauthorized', status=401)
+        name = values['name']
+        service_type = ServiceType(values['type'])
+        if not self.registered_services.is_registered(name, service_type):
+            return Response('Service not registered', status=404)
+        self.registered_services.unregister_service(name, service_type)
+        return Response('Service unregistered', status=200)
+
     def get_dns_record(self) -> Response:
         res = self._auth_get_dom()
         if isinstance(res, Response):
             return res
         domain, values = res
         dom_info = self.config.get_dns_api(domain)
-        dns_result = dns.get_all_dns_record(dom_info.zone_id, dom_info.email, dom_info.api_key)
+        throttled = self._throttle_dns(dom_info, 1)
+        if throttled is not None:
+            return throttled
+        with phase('upstream'):
+            dns_result = dns.get_all_dns_record(dom_info.zone_id, dom_info.email, dom_info.api_key)
         if dns_result is None:
             return Response('Error', status=500)
         else:
-            resp = Response(status=200)
-            resp.content_type = 'application/json'
-            resp.data = json.dumps(dns_result)
-            return resp
+            return self._data_response(dns_result)
+
+    def _throttle_dns(self, dom_info: DnsApiConfig, calls: int) -> Response | None:
+        # reads and deletes are not queued but still count against the account's upstream budget
+        bucket = self.dns_scheduler.bucket(dom_info.email, dom_info.api_key)
+        with phase('upstream'):
+            acquired = bucket.acquire(calls, self.config.dns_write_deadline)
+        if not acquired:
+            return Response('Upstream rate limit reached', status=503,
+                            headers={'Retry-After': str(math.ceil(calls / bucket.rate))})
+        return None
 
     def add_or_update_dns_record(self) -> Response:
         res = self._auth_get_dom()
@@ -123,43 +313,25 @@ class Server:
             return res
         domain, values = res
         dom_info = self.config.get_dns_api(domain)
-        dns_result = dns.get_all_dns_record(dom_info.zone_id, dom_info.email, dom_info.api_key)
-        if dns_result is None:
+        ttl = values.get('ttl', None)
+        if ttl is not None:
+            ttl = int(ttl)
+        priority = values.get('priority', None)
+        if priority is not None:
+            priority = int(priority)
+        proxied = values.get('proxied', False)
+        write = DnsWrite(dom_info.zone_id, dom_info.email, dom_info.api_key, values['type'], domain, values['content'],
+                         ttl, priority, proxied)
+        ticket = self.dns_scheduler.submit(write)
+        # wait=false (or a deadline passing) answers 202 and leaves the write queued
+        wait = values.get('wait', True) not in (False, 'false', '0', 0)
+        with phase('upstream'):
+            done = wait and ticket.wait(self.config.dns_write_deadline)
+        if not done:
+            return self._data_response({'type': 'queued', 'result': None}, status=202)
+        if ticket.result is None:
             return Response('Error', status=500)
-        else:
-            rec_type = values['type']
-            content = values['content']
-            ttl = values.get('ttl', None)
-            if ttl is not None:
-                ttl = int(ttl)
-            priority = values.get('priority', None)
-            if priority is not None:
-                priority = int(priority)
-            proxied = values.get('proxied', False)
-
-            # if domain in dns_result:
-            has_dns = False
-            rec_id = ''
-            for dns_record in dns_result:
-                if dns_record['name'] == domain:
-                    has_dns = True
-                    rec_id = dns_record['id']
-                    break
-            if has_dns:
-                # update dns
-                resp = dns.update_dns_record(dom_info.zone_id, dom_info.email, dom_info.api_key,
-                                             rec_id, rec_type, domain, content, ttl, proxied)
-            else:
-                # add dns
-                resp = dns.create_dns_record(dom_info.zone_id, dom_info.email, dom_info.api_key,
-                                             rec_type, domain, content, ttl, priority, proxied)
-            if resp is None:
-                return Response('Error', status=500)
-            else:
-                ret = Response(status=200)
-                ret.content_type = 'application/json'
-                ret.data = json.dumps({'type': 'update' if has_dns else 'add', 'result': resp})
-                return ret
+        return self._data_response({'type': ticket.operation, 'result': ticket.result})
 
     def delete_dns_record(self) -> Response:
         res = self._auth_get_dom()
@@ -167,7 +339,11 @@ class Server:
             return res
         domain, values = res
         dom_info = self.config.get_dns_api(domain)
-        dns_result = dns.get_all_dns_record(dom_info.zone_id, dom_info.email, dom_info.api_key)
+        throttled = self._throttle_dns(dom_info, 2)
+        if throttled is not None:
+            return throttled
+        with phase('upstream'):
+            dns_result = dns.get_all_dns_record(dom_info.zone_id, dom_info.email, dom_info.api_key)
         if dns_result is None:
             return Response('Error', status=500)
         else:
@@ -179,56 +355,96 @@ class Server:
             if rec_id == '':
                 return Response('DNS Record not found', status=404)
             else:
-                resp = dns.delete_dns_record(dom_info.zone_id, dom_info.email, dom_info.api_key, rec_id)
+                with phase('upstream'):
+                    resp = dns.delete_dns_record(dom_info.zone_id, dom_info.email, dom_info.api_key, rec_id)
                 if resp is None:
                     return Response('Error', status=500)
                 else:
-                    ret = Response(status=200)
-                    ret.content_type = 'application/json'
-                    ret.data = json.dumps(resp)
-                    return ret
+                    return self._data_response(resp)
 
     def get_service_status(self) -> Response:
-        if request.method == 'GET':
-            values = request.args
-        else:
-            values = request.get_json()
+        values = self._request_values()
         token = values.get('token', 'none')
         show_detail = True
         if not self.config.evaluate_access_token(token):
             show_detail = False
-        result = {}
-        for name, srv in self.registered_services.services.items():
-            if srv is ServiceType.DNS and not show_detail:
-                continue
-            status = 'offline' if srv.valid else ('online' if srv.valid_until > time.time() else 'unknown/expired')
-            r = {
-                'type': srv.type.name,
-                'description': srv.description,
-                'status': status,
-            }
-            if show_detail:
-                r['create_time'] = datetime.datetime.fromtimestamp(srv.create_time).strftime('%Y-%m-%d %H:%M:%S')
-                r['data'] = srv.data
-            result[name] = r
-        resp = Response(status=200)
-        resp.content_type = 'application/json'
-        resp.data = json.dumps(result)
-        return resp
+        return self._data_response(self.registered_services.status_report(show_detail))
+
+    def profiling(self) -> Response:
+        values = self._request_values()
+        token = values.get('token', 'none')
+        if not self.config.evaluate_admin_token(token):
+            return Response('Unauthorized', status=401)
+        # sample_rate and slow_threshold switch profiling at runtime, flush writes the pending profiles now
+        if 'sample_rate' in values:
+            self.config.profiling.sample_rate = min(1.0, max(0.0, float(values['sample_rate'])))
+        if 'slow_threshold' in values:
+            self.config.profiling.slow_threshold = max(0.0, float(values['slow_threshold']))
+        if values.get('flush', False) not in (False, 'false', '0', 0):
+            self.profiler.flush()
+        return self._data_response(self.profiler.status())
+
+    def replication_log(self) -> Response:
+        values = self._request_values()
+        token = values.get('token', 'none')
+        if not self.config.evaluate_admin_token(token):
+            return Response('Unauthorized', status=401)
+        # waits up to `wait` seconds for entries after `since`
+        wait = min(float(values.get('wait', 0)), 60.0)
+        log = self.registered_services.log
+        entries = log.since(int(values.get('since', 0)), str(values.get('epoch', '')), wait)
+        if entries is None:
+            return Response('Snapshot required', status=410)
+        return self._data_response({'epoch': log.epoch, 'entries': entries})
+
+    def replication_snapshot(self) -> Response:
+        values = self._request_values()
+        token = values.get('token', 'none')
+        if not self.config.evaluate_admin_token(token):
+            return Response('Unauthorized', status=401)
+        self.registered_services.loaded.wait()
+        # taken before the services, so that concurrent changes are in the log the replica reads next
+        log = self.registered_services.log
+        seq = log.seq
+        services = {name: encode_put(srv) for name, srv in list(self.registered_services.services.items())}
+        return self._data_response({'epoch': log.epoch, 'seq': seq, 'services': services,
+                                    'history': self.registered_services.history.to_dict()})
 
-    def run(self):
-        self.app.run()
+    def run(self, host: str | None = None, port: int | None = None):
+        self.app.run(host, port)
 
 
 def main():
+    started = time.monotonic()
+    parser = argparse.ArgumentParser(description='Service manager server')
+    parser.add_argument('--config', default=CFG_FILE_PATH, help='configuration file')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--store', default=SNAPSHOT_PATH, help='service store')
+    parser.add_argument('--history', default=HISTORY_STORE_PATH, help='history store')
+    parser.add_argument('--role', choices=['standalone', 'primary', 'replica'],
+                        help='replication role, overrides general.replication.role')
+    parser.add_argument('--primary-url', help='base URL of the primary, overrides general.replication.primary_url')
+    args = parser.parse_args()
     config = Config()
-    if not config.load():
+    if not config.load(args.config):
         print('CFG error')
         return
-    registered_services = RegisteredServices()
-    registered_services.load()
-    server = Server(__name__, config, registered_services)
-    server.run()
+    if args.role:
+        config.replication.role = args.role
+    if args.primary_url:
+        config.replication.primary_url = args.primary_url
+    if config.dns_api_url:
+        dns.set_base_url(config.dns_api_url)
+    replica = config.replication.role == 'replica'
+    registered_services = RegisteredServices(config.compact_registry, config.history, args.history, args.store,
+                                             persist=not replica)
+    if not replica:
+        # services are decoded in the background so that requests are served right away
+        registered_services.load(background=True)
+        atexit.register(registered_services.save_history)
+    server = Server(__name__, config, registered_services, started)
+    server.run(args.host, args.port)
 
 
 if __name__ == '__main__':
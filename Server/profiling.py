@@ -0,0 +1,220 @@
+import cProfile
+import functools
+import glob
+import os
+import pstats
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+
+# phases of the slow-request breakdown, time not spent in any of them is reported as other
+PHASES = ('auth', 'registry', 'store', 'upstream')
+
+_local = threading.local()
+
+
+@dataclass
+class ProfilingConfig:
+    """
+    Request profiling, off by default and switchable at runtime through /api/admin/profiling
+
+    Attributes
+    ----------
+    sample_rate : float = 0
+        Fraction of the requests run under cProfile
+    slow_threshold : float = 0
+        Requests taking longer are logged with a breakdown of their time (in seconds), 0 to disable
+    directory : str = PROFILE_DIR
+        Directory the aggregated profiles are written to
+    flush_requests : int = 100
+        Number of profiled requests aggregated into one file
+    flush_interval : float = 600
+        Maximum time a profiled request waits to be written (in seconds)
+    max_files : int = 20
+        Number of profile files kept, the oldest ones are deleted
+    """
+
+    sample_rate: float = 0
+    slow_threshold: float = 0
+    directory: str = PROFILE_DIR
+    flush_requests: int = 100
+    flush_interval: float = 600
+    max_files: int = 20
+
+
+class phase:
+    """
+    Context manager accounting the time of a block to a phase of the current request
+
+    Nested phases are exclusive, time spent in an inner phase is not counted for the outer one. Does nothing
+    outside of a timed request.
+
+    Parameters
+    ----------
+    name : str
+        One of PHASES
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is not None:
+            self.start = time.perf_counter()
+            # time of nested phases, subtracted from this one
+            stack.append(0.0)
+        return self
+
+    def __exit__(self, *exc):
+        stack = getattr(_local, 'stack', None)
+        if stack is not None:
+            elapsed = time.perf_counter() - self.start
+            nested = stack.pop()
+            _local.timings[self.name] = _local.timings.get(self.name, 0.0) + elapsed - nested
+            if stack:
+                stack[-1] += elapsed
+        return False
+
+
+def timed(name: str):
+    """
+    Decorator accounting the time of a function to a phase of the current request, see ``phase``
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'stack', None) is None:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RequestProfiler:
+    """
+    Samples requests under cProfile and logs slow requests
+
+    The sampled profiles are aggregated and written to ``config.directory`` every ``flush_requests`` requests
+    or ``flush_interval`` seconds, keeping the ``max_files`` newest files.
+
+    Parameters
+    ----------
+    config : ProfilingConfig
+        Sampling and logging settings, may be changed at runtime
+    """
+
+    def __init__(self, config: ProfilingConfig):
+        self.config = config
+        self.stats: pstats.Stats | None = None
+        self.pending = 0
+        self.profiled = 0
+        self.slow = 0
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        # only one cProfile profiler can be active at a time in recent Pythons
+        self._profile_lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.config.sample_rate > 0 or self.config.slow_threshold > 0
+
+    def run(self, label: str, func: callable, *args, **kwargs):
+        """
+        Run a request handler, profiled and timed according to the configuration
+
+        Parameters
+        ----------
+        label : str
+            Description of the request for the slow-request log, e.g. method and path
+        func : callable
+            The handler
+        """
+        if not self.active:
+            return func(*args, **kwargs)
+        profile = None
+        if self.config.sample_rate > 0 and random.random() < self.config.sample_rate \
+                and self._profile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+        _local.stack = []
+        _local.timings = {}
+        start = time.perf_counter()
+        try:
+            if profile is None:
+                return func(*args, **kwargs)
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            timings = _local.timings
+            _local.stack = None
+            if profile is not None:
+                self._profile_lock.release()
+                self._add(profile)
+            if 0 < self.config.slow_threshold <= elapsed:
+                self._log_slow(label, elapsed, timings)
+
+    def _log_slow(self, label: str, elapsed: float, timings: Dict[str, float]) -> None:
+        with self._lock:
+            self.slow += 1
+        other = elapsed - sum(timings.values())
+        parts = ', '.join(f'{name} {timings.get(name, 0.0) * 1000:.1f} ms' for name in PHASES)
+        print(f'Slow request {label}: {elapsed * 1000:.1f} ms ({parts}, other {other * 1000:.1f} ms)')
+
+    def _add(self, profile: cProfile.Profile) -> None:
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.pending += 1
+            self.profiled += 1
+            due = self.pending >= self.config.flush_requests \
+                or time.monotonic() - self.last_flush >= self.config.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self) -> str | None:
+        """
+        Write the aggregated profiles to a new file and delete the oldest files
+
+        Returns
+        -------
+        str | None
+            Path of the written file (named after the total number of profiled requests), None if there was
+            nothing to write
+        """
+        with self._lock:
+            stats, self.stats = self.stats, None
+            self.pending = 0
+            total = self.profiled
+            self.last_flush = time.monotonic()
+        if stats is None:
+            return None
+        os.makedirs(self.config.directory, exist_ok=True)
+        path = os.path.join(self.config.directory, f'requests-{time.strftime("%Y%m%d-%H%M%S")}-{total}.pstats')
+        stats.dump_stats(path)
+        for old in self.files()[:-max(1, self.config.max_files)]:
+            os.remove(old)
+        return path
+
+    def files(self) -> list:
+        # oldest first
+        return sorted(glob.glob(os.path.join(self.config.directory, '*.pstats')), key=os.path.getmtime)
+
+    def status(self) -> dict:
+        return {
+            'sample_rate': self.config.sample_rate,
+            'slow_threshold': self.config.slow_threshold,
+            'profiled': self.profiled,
+            'pending': self.pending,
+            'slow': self.slow,
+            'files': [os.path.basename(f) for f in self.files()],
+        }
@@ -0,0 +1,207 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import requests
+
+from cloudflare_v4_api import dns
+from config import Config
+from data import DnsApiConfig, ServiceType
+from dns_scheduler import DnsWriteScheduler
+from service import RegisteredServices
+
+
+@dataclass
+class DesiredRecord:
+    """
+    A DNS record derived from a registered DNS service
+
+    Attributes
+    ----------
+    name : str
+        Record name (the service's data.domain)
+    rec_type : str
+        A or AAAA, from the reported address
+    content : str
+        Last address reported by the service's agent
+    ttl : int | None
+        TTL from the service's data, None to accept any
+    proxied : bool | None
+        Proxied flag from the service's data, None to accept any
+    """
+
+    name: str
+    rec_type: str
+    content: str
+    ttl: int | None = None
+    proxied: bool | None = None
+
+    def matches(self, record: dict) -> bool:
+        return record['content'] == self.content \
+            and (self.ttl is None or record.get('ttl') == self.ttl) \
+            and (self.proxied is None or record.get('proxied') == self.proxied)
+
+    def body(self) -> dict:
+        return {
+            'type': self.rec_type,
+            'name': self.name,
+            'content': self.content,
+            'ttl': 1 if self.ttl is None else self.ttl,
+            'proxied': bool(self.proxied),
+        }
+
+
+def diff_records(records: List[dict], desired: Dict[Tuple[str, str], DesiredRecord]) \
+        -> Tuple[List[dict], List[dict], List[str]]:
+    """
+    Compute the minimal changes turning the records of a zone into the desired ones
+
+    Only (name, type) pairs with a desired record are touched: a missing record is created, a differing one
+    overwritten and duplicates of the same name and type deleted.
+
+    Parameters
+    ----------
+    records : List[dict]
+        Current records of the zone
+    desired : Dict[Tuple[str, str], DesiredRecord]
+        Desired records by (name, type)
+
+    Returns
+    -------
+    Tuple[List[dict], List[dict], List[str]]
+        Records to create, records to overwrite (with their id) and identifiers of records to delete
+    """
+    existing: Dict[Tuple[str, str], List[dict]] = {}
+    for record in records:
+        key = (record['name'], record['type'])
+        if key in desired:
+            existing.setdefault(key, []).append(record)
+    posts, puts, deletes = [], [], []
+    for key, want in desired.items():
+        current = existing.get(key)
+        if not current:
+            posts.append(want.body())
+            continue
+        # keep a record that already matches if there is one, so that nothing needs rewriting
+        keep = next((record for record in current if want.matches(record)), None)
+        if keep is None:
+            keep = current[0]
+            puts.append(dict(want.body(), id=keep['id']))
+        deletes.extend(record['id'] for record in current if record is not keep)
+    return posts, puts, deletes
+
+
+class DnsReconciler:
+    """
+    Periodically brings the DNS zones in line with the registered DNS services
+
+    Each period every zone with desired records is read once, and the differences are applied with batch
+    requests, drawing from the same per-account budget as the DnsWriteScheduler.
+
+    Parameters
+    ----------
+    config : Config
+        Server configuration, for the zones and their API keys
+    registered_services : RegisteredServices
+        Registry the desired records are derived from
+    scheduler : DnsWriteScheduler
+        Write scheduler, its per-account buckets are shared and its pending records are left alone
+    interval : float
+        Time between two reconciliations (in seconds)
+    batch_size : int = 100
+        Maximum number of operations per batch request
+    """
+
+    def __init__(self, config: Config, registered_services: RegisteredServices, scheduler: DnsWriteScheduler,
+                 interval: float, batch_size: int = 100):
+        self.config = config
+        self.registered_services = registered_services
+        self.scheduler = scheduler
+        self.interval = interval
+        self.batch_size = batch_size
+        self.last_stats = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def desired(self) -> Dict[str, Tuple[DnsApiConfig, Dict[Tuple[str, str], DesiredRecord]]]:
+        zones = {}
+        for srv in list(self.registered_services.services.values()):
+            if srv.type != ServiceType.DNS or not srv.address:
+                continue
+            data = srv.data or {}
+            # the data comes from the agents, a service with invalid values is left out of this pass
+            try:
+                domain = data.get('domain')
+                dom_info = self.config.get_dns_api(domain) if domain else None
+                if dom_info is None or not dom_info.edit:
+                    continue
+                ttl = data.get('ttl')
+                proxied = data.get('proxied')
+                record = DesiredRecord(domain, 'AAAA' if ':' in srv.address else 'A', srv.address,
+                                       None if ttl is None else int(ttl), None if proxied is None else bool(proxied))
+            except (AttributeError, TypeError, ValueError) as e:
+                print(f'Reconciliation skipped {srv.name}, invalid data: {e!r}')
+                continue
+            zones.setdefault(dom_info.zone_id, (dom_info, {}))[1][(record.name, record.rec_type)] = record
+        return zones
+
+    def _apply(self, dom_info: DnsApiConfig, posts: List[dict], puts: List[dict], deletes: List[str]) -> int:
+        ops = [('deletes', d) for d in deletes] + [('puts', p) for p in puts] + [('posts', p) for p in posts]
+        errors = 0
+        bucket = self.scheduler.bucket(dom_info.email, dom_info.api_key)
+        for i in range(0, len(ops), self.batch_size):
+            chunk = {'deletes': [], 'puts': [], 'posts': []}
+            for kind, op in ops[i:i + self.batch_size]:
+                chunk[kind].append(op)
+            bucket.acquire(1)
+            result = dns.batch_dns_records(dom_info.zone_id, dom_info.email, dom_info.api_key,
+                                           posts=chunk['posts'], puts=chunk['puts'], deletes=chunk['deletes'])
+            if result is None:
+                errors += 1
+        return errors
+
+    def reconcile_once(self) -> dict:
+        """
+        Run one reconciliation of every zone
+
+        Returns
+        -------
+        dict
+            Number of zones read and records created, overwritten and deleted, and failed requests
+        """
+        stats = {'zones': 0, 'posts': 0, 'puts': 0, 'deletes': 0, 'errors': 0}
+        pending = set(self.scheduler.pending())
+        for zone_id, (dom_info, desired) in self.desired().items():
+            # records with a queued write are about to change anyway
+            desired = {k: v for k, v in desired.items() if (zone_id, k[0], k[1]) not in pending}
+            if not desired:
+                continue
+            self.scheduler.bucket(dom_info.email, dom_info.api_key).acquire(1)
+            try:
+                records = dns.get_all_dns_record(zone_id, dom_info.email, dom_info.api_key)
+                stats['zones'] += 1
+                if records is None:
+                    stats['errors'] += 1
+                    continue
+                posts, puts, deletes = diff_records(records, desired)
+                stats['errors'] += self._apply(dom_info, posts, puts, deletes)
+            except (requests.exceptions.RequestException, ValueError, KeyError):
+                stats['errors'] += 1
+                continue
+            stats['posts'] += len(posts)
+            stats['puts'] += len(puts)
+            stats['deletes'] += len(deletes)
+        self.last_stats = stats
+        return stats
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reconcile_once()
+            except Exception as e:
+                # the next pass starts over, the thread must not end
+                print(f'Reconciliation failed: {e!r}')
+
+    def start(self) -> None:
+        self._thread.start()
@@ -0,0 +1,192 @@
+import secrets
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import requests
+
+import serialization
+from data import Service, ServiceType
+
+
+@dataclass
+class ReplicationConfig:
+    """
+    Replication of the registry from a primary server to read replicas
+
+    Attributes
+    ----------
+    role : str = 'standalone'
+        standalone, primary (keeps a mutation log for replicas) or replica
+    primary_url : str = ''
+        Base URL of the primary, for replicas
+    log_size : int = 10000
+        Mutations the primary keeps, a replica further behind reloads a full snapshot
+    forward_writes : bool = True
+        Whether replicas forward writes to the primary, otherwise they reject them with 421
+    poll_wait : float = 20
+        How long a replica's request for new mutations waits on the primary (in seconds)
+    retry_interval : float = 5
+        Time between two attempts of a replica to reach its primary (in seconds)
+    """
+
+    role: str = 'standalone'
+    primary_url: str = ''
+    log_size: int = 10000
+    forward_writes: bool = True
+    poll_wait: float = 20
+    retry_interval: float = 5
+
+
+class ReplicationLog:
+    """
+    Mutations of the registry of a primary, numbered so that replicas can ask for the ones they miss
+
+    Entries are lists: ``[seq, 'put', name, service, metrics]``, ``[seq, 'del', name]`` or
+    ``[seq, 'beat', name, time, valid, latency]``. Sequence numbers start over when the primary restarts, they
+    are only meaningful together with the log's ``epoch``.
+
+    Parameters
+    ----------
+    size : int
+        Number of entries kept
+    """
+
+    def __init__(self, size: int):
+        self.entries = deque(maxlen=size)
+        self.seq = 0
+        # random id of this log, a replica holding another epoch missed a restart of the primary
+        self.epoch = secrets.token_hex(8)
+        self._cond = threading.Condition()
+
+    def append(self, *entry) -> None:
+        with self._cond:
+            self.seq += 1
+            self.entries.append([self.seq, *entry])
+            self._cond.notify_all()
+
+    def since(self, seq: int, epoch: str, wait: float = 0, limit: int = 1000) -> List[list] | None:
+        """
+        Entries after ``seq``
+
+        Parameters
+        ----------
+        seq : int
+            Last entry the caller has
+        epoch : str
+            Epoch of the log the caller's entries come from
+        wait : float = 0
+            How long to wait for new entries if there are none (in seconds)
+        limit : int = 1000
+            Maximum number of entries returned
+
+        Returns
+        -------
+        List[list] | None
+            The entries, None if some of them are not kept anymore or the caller's entries come from another log
+        """
+        if epoch != self.epoch:
+            return None
+        with self._cond:
+            if seq >= self.seq and wait > 0:
+                self._cond.wait_for(lambda: self.seq > seq, wait)
+            if seq > self.seq:
+                return None
+            missing = self.seq - seq
+            if missing > len(self.entries):
+                return None
+            entries = list(self.entries)[len(self.entries) - missing:]
+        return entries[:limit]
+
+
+def encode_put(srv: Service) -> Tuple[dict, dict | None]:
+    return serialization.encode_service(srv), srv.metrics
+
+
+def decode_put(service: dict, metrics: dict | None) -> Service:
+    v = dict(service)
+    v['type'] = ServiceType(v['type'])
+    srv = Service(**v)
+    srv.metrics = metrics
+    return srv
+
+
+class Replica:
+    """
+    Keeps the registry of a replica in sync with its primary: a full snapshot first, then the mutation log
+    polled incrementally
+
+    Parameters
+    ----------
+    config : ReplicationConfig
+        Primary URL and polling settings
+    registered_services : RegisteredServices
+        The replica's registry
+    token : str
+        Token of the primary's replication endpoints (its admin token)
+    """
+
+    def __init__(self, config: ReplicationConfig, registered_services, token: str):
+        self.config = config
+        self.registered_services = registered_services
+        self.token = token
+        # last applied entry, None until a snapshot is loaded, and epoch of the primary's log it belongs to
+        self.seq: int | None = None
+        self.epoch = ''
+        self.last_sync = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _get(self, path: str, params: dict, timeout: float) -> requests.Response:
+        return requests.get(f'{self.config.primary_url}{path}', params=dict(params, token=self.token),
+                            timeout=timeout)
+
+    def _load_snapshot(self) -> int:
+        resp = self._get('/api/repl/snapshot', {}, 60)
+        resp.raise_for_status()
+        snapshot = serialization.loads(resp.content)
+        self.registered_services.replace_all(
+            {name: decode_put(*put) for name, put in snapshot['services'].items()}, snapshot['history'])
+        self.epoch = snapshot['epoch']
+        print(f'Replica loaded a snapshot of {len(snapshot["services"])} services at {snapshot["seq"]}')
+        return snapshot['seq']
+
+    def _pull(self, seq: int) -> int | None:
+        resp = self._get('/api/repl/log', {'since': seq, 'epoch': self.epoch, 'wait': self.config.poll_wait},
+                         self.config.poll_wait + 10)
+        if resp.status_code == 410:
+            return None
+        resp.raise_for_status()
+        log = serialization.loads(resp.content)
+        if log['epoch'] != self.epoch:
+            return None
+        for entry in log['entries']:
+            self.apply(entry)
+            seq = entry[0]
+        return seq
+
+    def apply(self, entry: list) -> None:
+        op, name = entry[1], entry[2]
+        if op == 'put':
+            self.registered_services.register_service(name, decode_put(entry[3], entry[4]), save=False)
+        elif op == 'del':
+            srv = self.registered_services.get_service(name)
+            if srv is not None:
+                self.registered_services.unregister_service(name, srv.type, save=False)
+        elif op == 'beat':
+            self.registered_services.record_heartbeat(name, entry[4], entry[5], now=entry[3])
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self.seq is None:
+                    self.seq = self._load_snapshot()
+                self.seq = self._pull(self.seq)
+                self.last_sync = time.time()
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                print(f'Replication from {self.config.primary_url} failed: {e!r}')
+                time.sleep(self.config.retry_interval)
+
+    def start(self) -> None:
+        self._thread.start()
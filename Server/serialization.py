@@ -0,0 +1,206 @@
+"""
+Serialization of the service registry and of HTTP bodies
+
+Encoders are registered per type and looked up by exact type, so encoding a ``Service`` never goes through
+``dataclasses.asdict``. orjson or msgspec are used when installed, the stdlib ``json`` module otherwise.
+MessagePack (msgpack) and CBOR (cbor2) bodies are supported when the corresponding package is installed.
+"""
+import json
+from enum import Enum
+from typing import Any, Callable, Dict, Tuple
+
+from data import Service, ColumnarService
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+MIME_JSON = 'application/json'
+MIME_MSGPACK = 'application/msgpack'
+MIME_CBOR = 'application/cbor'
+
+# type: function returning a natively serializable object
+ENCODERS: Dict[type, Callable[[Any], Any]] = {}
+
+
+def register_encoder(cls: type, encoder: Callable[[Any], Any]) -> None:
+    """
+    Register the encoder of a type
+
+    Parameters
+    ----------
+    cls : type
+        The exact type handled by the encoder (subclasses need their own registration)
+    encoder : Callable[[Any], Any]
+        Function returning a natively serializable object (dict, list, str, ...)
+    """
+    ENCODERS[cls] = encoder
+
+
+def encode_service(srv: Service | ColumnarService) -> dict:
+    return {
+        'name': srv.name,
+        'type': srv.type.value,
+        'description': srv.description,
+        'create_time': srv.create_time,
+        'valid': srv.valid,
+        'valid_until': srv.valid_until,
+        'data': srv.data,
+        'fingerprint': srv.fingerprint,
+        'address': srv.address,
+    }
+
+
+register_encoder(Service, encode_service)
+register_encoder(ColumnarService, encode_service)
+
+
+def _default(o: Any) -> Any:
+    encoder = ENCODERS.get(o.__class__)
+    if encoder is not None:
+        return encoder(o)
+    if isinstance(o, Enum):
+        return o.value
+    raise TypeError(f'Object of type {o.__class__.__name__} is not serializable')
+
+
+# dumps(obj) -> bytes: compact UTF-8 JSON, loads(bytes | str) -> object
+if orjson is not None:
+    BACKEND = 'orjson'
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+elif msgspec is not None:
+    BACKEND = 'msgspec'
+    _msgspec_encoder = msgspec.json.Encoder(enc_hook=_default)
+
+    def dumps(obj: Any) -> bytes:
+        return _msgspec_encoder.encode(obj)
+
+    loads = msgspec.json.decode
+else:
+    BACKEND = 'json'
+    _json_encoder = json.JSONEncoder(default=_default, separators=(',', ':'), ensure_ascii=False)
+
+    def dumps(obj: Any) -> bytes:
+        return _json_encoder.encode(obj).encode('utf-8')
+
+    loads = json.loads
+
+
+class UnsupportedMediaType(ValueError):
+    pass
+
+
+def _check_json_compatible(obj: Any) -> None:
+    # MessagePack and CBOR carry values JSON cannot store (bytes, tags, huge integers), the store is JSON
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        cls = o.__class__
+        if cls is dict:
+            for k, v in o.items():
+                if k.__class__ is not str:
+                    raise ValueError(f'Unsupported key type: {k.__class__.__name__}')
+                stack.append(v)
+        elif cls is list:
+            stack.extend(o)
+        elif cls is int:
+            if not -2 ** 63 <= o < 2 ** 64:
+                raise ValueError('Integer out of range')
+        elif o is not None and cls not in (str, float, bool):
+            raise ValueError(f'Unsupported value type: {cls.__name__}')
+
+
+# mime type: (dumps, loads), JSON first so it wins content negotiation on wildcards
+CODECS: Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {MIME_JSON: (dumps, loads)}
+
+if msgpack is not None:
+    def _msgpack_dumps(obj: Any) -> bytes:
+        return msgpack.packb(obj, default=_default)
+
+    def _msgpack_loads(raw: bytes) -> Any:
+        return msgpack.unpackb(raw)
+
+    CODECS[MIME_MSGPACK] = (_msgpack_dumps, _msgpack_loads)
+    CODECS['application/x-msgpack'] = CODECS[MIME_MSGPACK]
+    CODECS['application/vnd.msgpack'] = CODECS[MIME_MSGPACK]
+
+if cbor2 is not None:
+    def _cbor_default(encoder, o: Any) -> None:
+        encoder.encode(_default(o))
+
+    def _cbor_dumps(obj: Any) -> bytes:
+        return cbor2.dumps(obj, default=_cbor_default)
+
+    CODECS[MIME_CBOR] = (_cbor_dumps, cbor2.loads)
+
+
+def decode_body(content_type: str, raw: bytes) -> Any:
+    """
+    Decode a request body according to its content type
+
+    Parameters
+    ----------
+    content_type : str
+        Value of the Content-Type header, parameters are ignored
+    raw : bytes
+        Request body
+
+    Returns
+    -------
+    Any
+        Decoded object
+
+    Raises
+    ------
+    UnsupportedMediaType
+        If the content type is not supported (or its package is not installed)
+    ValueError
+        If the body is malformed or holds values JSON cannot represent
+    """
+    mime = content_type.split(';', 1)[0].strip().lower() or MIME_JSON
+    if mime not in CODECS:
+        raise UnsupportedMediaType(f'Unsupported content type: {mime}')
+    obj = CODECS[mime][1](raw)
+    if mime != MIME_JSON:
+        _check_json_compatible(obj)
+    return obj
+
+
+def encode_body(obj: Any, mime: str = MIME_JSON) -> bytes:
+    """
+    Encode a response body
+
+    Parameters
+    ----------
+    obj : Any
+        Object made of JSON types and types with a registered encoder
+    mime : str = 'application/json'
+        One of the keys of CODECS
+
+    Returns
+    -------
+    bytes
+        Encoded body
+    """
+    return CODECS[mime][0](obj)
@@ -1,59 +1,337 @@
 import os
-import json
+import threading
+import time
+from typing import Dict, List
 
-from data import Service, ServiceType
+from data import Service, ServiceType, ServiceColumns, ColumnarService, JsonText
+from history import HistoryConfig, HistoryStore, HISTORY_STORE_PATH
+from profiling import timed
+from replication import encode_put
 
-from utils import DataclassEnumJSONEncoder
+import serialization
 
 DATA_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_store.json')
+# a JSON list of the names on the first line, then one service per line in the same order, so that the
+# services can be indexed by name without decoding them
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_store.jsonl')
+
+_EMPTY_DATA = JsonText('{}')
 
 
 class RegisteredServices:
-    def __init__(self):
-        # name(str): data(Service)
+    def __init__(self, compact: bool = False, history_config: HistoryConfig | None = None,
+                 history_path: str = HISTORY_STORE_PATH, store_path: str = SNAPSHOT_PATH, persist: bool = True):
+        # name(str): data(Service), or data(ColumnarService) in compact mode
         self.services = {}
+        # compact mode keeps the scalar fields in shared arrays and the data as JSON text until accessed
+        self.columns = ServiceColumns() if compact else None
+        self.history = HistoryStore(history_config)
+        self.history_path = history_path
+        self.store_path = store_path
+        # replicas keep their state in memory only, it is reloaded from the primary on start
+        self.persist = persist
+        # mutation log shipped to replicas (ReplicationLog), on primaries only
+        self.log = None
+        # name(str): snapshot line of the services not decoded yet, while loading in the background
+        # services are decoded on first access
+        self._unloaded: Dict[str, bytes] = {}
+        self._load_order: List[str] = []
+        self._load_next = 0
+        self._load_lock = threading.RLock()
+        # saves of the store triggered by concurrent requests, they share the temporary file
+        self._save_lock = threading.Lock()
+        # heartbeats received before the history store is loaded, replayed once it is
+        self._early_heartbeats: List[tuple] | None = None
+        self.loaded = threading.Event()
+        self.loaded.set()
+
+    def _compact(self, service: Service) -> Service | ColumnarService:
+        if self.columns is None or isinstance(service, ColumnarService):
+            return service
+        data = service.data
+        if data is not None:
+            # most services have no data, they all share one instance
+            data = _EMPTY_DATA if not data else JsonText(serialization.dumps(data).decode('utf-8'))
+        return ColumnarService(self.columns, service.name, service.type, service.description, service.create_time,
+                               service.valid, service.valid_until, data, service.fingerprint, service.address)
+
+    def _discard(self, name: str) -> None:
+        srv = self.services.pop(name, None)
+        if isinstance(srv, ColumnarService):
+            self.columns.release(srv.slot)
+
+    def _put(self, name: str, service: Service) -> None:
+        # replaced in place, the size of the dict only changes for new services, see status_report
+        prev = self.services.get(name)
+        self.services[name] = self._compact(service)
+        if isinstance(prev, ColumnarService):
+            self.columns.release(prev.slot)
+
+    def _insert(self, name: str, raw: bytes) -> None:
+        v = serialization.loads(raw)
+        v['type'] = ServiceType(v['type'])
+        self.services[name] = self._compact(Service(**v))
+
+    def _materialize(self, name: str) -> None:
+        if self.loaded.is_set():
+            return
+        # checked under the lock, the background thread pops and inserts services concurrently
+        with self._load_lock:
+            raw = self._unloaded.pop(name, None)
+            if raw is not None:
+                self._insert(name, raw)
+
+    def _load_rest(self, chunk: int = 1000) -> None:
+        # decode the services still in the snapshot, a chunk at a time so that requests interleave
+        while self._unloaded:
+            with self._load_lock:
+                for name in self._load_order[self._load_next:self._load_next + chunk]:
+                    raw = self._unloaded.pop(name, None)
+                    if raw is not None:
+                        self._insert(name, raw)
+                self._load_next += chunk
+                if not self._unloaded:
+                    self._load_order = []
 
-    def load(self, path: str = DATA_STORE_PATH) -> bool:
+    def load_legacy(self, path: str = DATA_STORE_PATH) -> bool:
         try:
-            with open(path, 'r') as f:
-                raw_data = json.load(f)
+            with open(path, 'rb') as f:
+                raw_data = serialization.loads(f.read())
         except FileNotFoundError:
             return False
         for k, v in raw_data.items():
             v['type'] = ServiceType(v['type'])
-            self.services[k] = Service(**v)
+            self.services[k] = self._compact(Service(**v))
         return True
 
-    def save(self, path: str = DATA_STORE_PATH):
-        with open(path, 'w') as f:
-            json.dump(self.services, f, indent=4, cls=DataclassEnumJSONEncoder)
+    def load(self, path: str | None = None, legacy_path: str = DATA_STORE_PATH, background: bool = False) -> bool:
+        """
+        Load the registered services and their history
 
+        Parameters
+        ----------
+        path : str | None = None
+            Snapshot written by ``save``, ``store_path`` if None
+        legacy_path : str = DATA_STORE_PATH
+            JSON store of older versions, read when there is no snapshot
+        background : bool = False
+            Only index the snapshot and return, the services are decoded by a background thread or when first
+            accessed, and heartbeats are buffered until the history is loaded. ``loaded`` is set when done.
+
+        Returns
+        -------
+        bool
+            False if there was no store
+        """
+        start = time.monotonic()
+        try:
+            with open(path or self.store_path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            found = self.load_legacy(legacy_path)
+            self.history.load(self.history_path)
+            return found
+        head, _, body = raw.partition(b'\n')
+        names = serialization.loads(head)
+        with self._load_lock:
+            self._unloaded = dict(zip(names, body.split(b'\n')))
+            self._load_order = names
+            self._load_next = 0
+        del raw, body
+        if not background:
+            self._load_rest()
+            self.history.load(self.history_path)
+            return True
+        self._early_heartbeats = []
+        self.loaded.clear()
+        threading.Thread(target=self._load_background, args=(start,), daemon=True).start()
+        return True
+
+    def _load_background(self, start: float) -> None:
+        # the load always finishes, otherwise heartbeats would be buffered and snapshots awaited forever
+        history = HistoryStore(self.history.config)
+        try:
+            history.load(self.history_path)
+        except Exception as e:
+            print(f'Could not load the history store {self.history_path}, starting with an empty history: {e!r}')
+            history = HistoryStore(self.history.config)
+        try:
+            with self._load_lock:
+                for name, t, valid, latency in self._early_heartbeats:
+                    history.record(name, t, valid, latency)
+                    if self.log is not None:
+                        self.log.append('beat', name, t, valid, latency)
+                # histories of services unregistered in the meantime
+                for name in [n for n in history.histories if n not in self.services and n not in self._unloaded]:
+                    history.discard(name)
+                self.history = history
+                self._early_heartbeats = None
+            self._load_rest()
+            print(f'Store loaded: {len(self.services)} services in {time.monotonic() - start:.3f} s')
+        except Exception as e:
+            print(f'Loading the store failed after {len(self.services)} services: {e!r}')
+        finally:
+            with self._load_lock:
+                self._early_heartbeats = None
+            self.loaded.set()
+
+    @timed('store')
+    def save(self, path: str | None = None):
+        if not self.persist:
+            return
+        path = path or self.store_path
+        with self._save_lock:
+            with self._load_lock:
+                # one copy for both the names and the lines, so that they line up even if services change meanwhile
+                items = list(self.services.items())
+                lines = [serialization.dumps(srv) for _, srv in items]
+                # services not decoded yet are written back as they were read
+                unloaded = list(self._unloaded.items())
+            names = [name for name, _ in items] + [name for name, _ in unloaded]
+            lines.extend(raw for _, raw in unloaded)
+            tmp = f'{path}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(b'\n'.join([serialization.dumps(names)] + lines))
+            os.replace(tmp, path)
+
+    @timed('registry')
     def is_registered(self, name: str, service_type: ServiceType) -> bool:
+        self._materialize(name)
         return name in self.services and self.services[name].type == service_type
 
-    def register_service(self, name: str, service: Service):
-        self.services[name] = service
-        self.save()
+    @timed('registry')
+    def register_service(self, name: str, service: Service, save: bool = True):
+        self._materialize(name)
+        with self._load_lock:
+            self._put(name, service)
+        self.touched(name)
+        if save:
+            self.save()
 
-    def unregister_service(self, name: str, service_type: ServiceType):
+    @timed('registry')
+    def unregister_service(self, name: str, service_type: ServiceType, save: bool = True):
+        self._materialize(name)
         if name in self.services and self.services[name].type == service_type:
-            del self.services[name]
-            self.save()
+            with self._load_lock:
+                self._discard(name)
+            self.history.discard(name)
+            if self.log is not None:
+                self.log.append('del', name)
+            if save:
+                self.save()
 
+    def touched(self, name: str) -> None:
+        """
+        Log the current state of a service for the replicas, to be called after changing its fields in place
+        """
+        if self.log is not None and name in self.services:
+            self.log.append('put', name, *encode_put(self.services[name]))
+
+    def replace_all(self, services: Dict[str, Service], history: dict) -> None:
+        """
+        Replace the whole registry and history, by the snapshot of a primary
+        """
+        with self._load_lock:
+            self._unloaded, self._load_order = {}, []
+            # swapped at once, readers see either the old or the new registry
+            old, self.services = self.services, {name: self._compact(srv) for name, srv in services.items()}
+            for srv in old.values():
+                if isinstance(srv, ColumnarService):
+                    self.columns.release(srv.slot)
+            store = HistoryStore(self.history.config)
+            store.load_dict(history)
+            self.history = store
+
+    @timed('registry')
     def same_service(self, name: str, service: Service) -> bool:
+        self._materialize(name)
         if name in self.services:
             prev_srv = self.services[name]
-            same = True
-            same &= prev_srv.name == service.name
-            same &= prev_srv.type == service.type
-            same &= prev_srv.description == service.description
-            same &= prev_srv.data == service.data
-            return same
+            return prev_srv.type == service.type and prev_srv.fingerprint == service.fingerprint
         return False
 
+    @timed('registry')
+    def same_fingerprint(self, name: str, service_type: ServiceType, fingerprint: str) -> bool:
+        return self.is_registered(name, service_type) and self.services[name].fingerprint == fingerprint
+
+    @timed('registry')
     def get_service(self, name: str) -> Service | None:
+        self._materialize(name)
         return self.services[name] if name in self.services else None
 
     def change_service(self, name: str, service: Service):
-        self.services[name] = service
-        self.save()
+        self.register_service(name, service)
+
+    @timed('registry')
+    def set_address(self, name: str, address: str):
+        self._materialize(name)
+        srv = self.services[name]
+        if srv.address != address:
+            srv.address = address
+            self.save()
+
+    @timed('registry')
+    def record_heartbeat(self, name: str, valid: bool, latency: float | None = None, now: float | None = None):
+        now = time.time() if now is None else now
+        if self._early_heartbeats is not None:
+            with self._load_lock:
+                if self._early_heartbeats is not None:
+                    self._early_heartbeats.append((name, now, valid, latency))
+                    return
+        self.history.record(name, now, valid, latency)
+        if self.log is not None:
+            self.log.append('beat', name, now, valid, latency)
+        if self.history.claim_save(now):
+            self.save_history()
+
+    @timed('store')
+    def save_history(self):
+        if not self.persist:
+            return
+        if self._early_heartbeats is not None:
+            # the store on disk is not loaded yet, saving now would lose it
+            return
+        self.history.save(self.history_path, time.time())
+
+    @timed('registry')
+    def history_report(self, name: str | None, window: float, grace: float) -> dict:
+        if name is None:
+            self._load_rest()
+        now = time.time()
+        since = now - window
+        result = {}
+        for srv_name in (list(self.services) if name is None else [name]):
+            history = self.history.get(srv_name)
+            if history is None:
+                continue
+            r = {
+                'uptime': history.uptime(since, now, grace),
+                'transitions': history.transitions(since),
+            }
+            if name is not None:
+                r['buckets'] = history.buckets(since)
+            result[srv_name] = r
+        return result
+
+    @timed('registry')
+    def status_report(self, show_detail: bool) -> dict:
+        self._load_rest()
+        now = time.time()
+        result = {}
+        # copied first, the services are changed by other request threads and, on replicas, the replication thread
+        for name, srv in list(self.services.items()):
+            if srv is ServiceType.DNS and not show_detail:
+                continue
+            status = 'offline' if srv.valid else ('online' if srv.valid_until > now else 'unknown/expired')
+            r = {
+                'type': srv.type.name,
+                'description': srv.description,
+                'status': status,
+            }
+            if show_detail:
+                r['create_time'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(srv.create_time))
+                r['data'] = srv.data
+                if srv.metrics is not None:
+                    r['metrics'] = srv.metrics
+            result[name] = r
+        return result
@@ -1,14 +1,70 @@
-import json
-import dataclasses
-from enum import Enum
-
-
-class DataclassEnumJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if dataclasses.is_dataclass(o):
-            d = dataclasses.asdict(o)
-            for k, v in d.items():
-                if isinstance(v, Enum):
-                    d[k] = v.value
-            return d
-        return super().default(o)
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second
+    burst : float
+        Capacity of the bucket, the bucket starts full
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, n: float = 1) -> float:
+        """
+        Take tokens if available
+
+        Parameters
+        ----------
+        n : float = 1
+            Number of tokens
+
+        Returns
+        -------
+        float
+            0 if the tokens were taken, otherwise the time until they are available (in seconds)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0.0
+            return (n - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def acquire(self, n: float = 1, timeout: float | None = None) -> bool:
+        """
+        Take tokens, waiting for them if needed
+
+        Parameters
+        ----------
+        n : float = 1
+            Number of tokens
+        timeout : float | None = None
+            Maximum time to wait (in seconds), None to wait as long as needed
+
+        Returns
+        -------
+        bool
+            True if the tokens were taken, False if they would not be available before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(n)
+            if wait == 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)